@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+
+# Aumentacao das composicoes em lotes: as imagens de mesmo tamanho sao empilhadas num unico array
+# (N, H, W, 3) uint8 e cada operacao roda no lote inteiro de uma vez.
+#   - brilho/contraste/HSV: uma tabela (LUT) de 256 valores por amostra e por canal; o lote vai para HSV
+#     e volta numa unica chamada do cvtColor cada, e as tabelas sao aplicadas com cv2.LUT
+#   - espelhamento horizontal/vertical, com as caixas (formato YOLO) remapeadas
+#   - desfoque gaussiano e ruido
+# Os parametros de cada amostra saem de um gerador numpy com a semente propria da amostra, entao o
+# resultado de uma amostra nao depende de com quais outras ela caiu no lote (nem do numero de processos)
+
+# Parametros padrao. Intervalos sao sorteados uniformemente em [-x, x] (ou [min, max] nas tuplas);
+# probabilidades entre 0 e 1. Qualquer chave pode ser sobrescrita no dict passado em `config`
+AUGMENT_DEFAULTS = {
+    'brightness': 20,         # soma no canal V (0-255)
+    'contrast': 0.2,          # multiplica (V - 128) por 1 +- contrast
+    'hue': 8,                 # desloca o matiz (0-179 no OpenCV)
+    'saturation': 0.3,        # multiplica S por 1 +- saturation
+    'hflip': 0.5,
+    'vflip': 0.0,
+    'blur': 0.1,
+    'blur_sigma': (0.5, 1.5),
+    'noise': 0.2,
+    'noise_std': (2.0, 8.0),
+}
+
+
+def sample_params(seed, config):
+    # Parametros de uma amostra, sorteados na ordem fixa abaixo com o gerador da semente da amostra
+    rng = np.random.default_rng(seed)
+    return {
+        'brightness': rng.uniform(-config['brightness'], config['brightness']),
+        'contrast': 1 + rng.uniform(-config['contrast'], config['contrast']),
+        'hue': rng.uniform(-config['hue'], config['hue']),
+        'saturation': 1 + rng.uniform(-config['saturation'], config['saturation']),
+        'hflip': rng.random() < config['hflip'],
+        'vflip': rng.random() < config['vflip'],
+        'blur_sigma': rng.uniform(*config['blur_sigma']) if rng.random() < config['blur'] else 0.0,
+        'noise_std': rng.uniform(*config['noise_std']) if rng.random() < config['noise'] else 0.0,
+        # Semente do ruido (gerado so para as amostras que tem ruido)
+        'noise_seed': int(rng.integers(2**31)),
+    }
+
+
+def build_luts(params):
+    # Tabelas (N, 256, 1, 3) para os canais H, S e V, no formato do cv2.LUT de 3 canais
+    values = np.arange(256, dtype=np.float32)
+    luts = np.empty((len(params), 256, 1, 3), dtype=np.uint8)
+    for n, p in enumerate(params):
+        # Matiz no OpenCV vai de 0 a 179 e da a volta
+        luts[n, :, 0, 0] = np.mod(np.round(np.minimum(values, 179) + p['hue']), 180).astype(np.uint8)
+        luts[n, :, 0, 1] = np.clip(np.round(values * p['saturation']), 0, 255).astype(np.uint8)
+        luts[n, :, 0, 2] = np.clip(np.round((values - 128) * p['contrast'] + 128 + p['brightness']),
+                                   0, 255).astype(np.uint8)
+    return luts
+
+
+def augment_batch(batch, boxes, seeds, config=None):
+    # batch: (N, H, W, 3) uint8 BGR (alterado no proprio lugar quando possivel); boxes: lista de N arrays
+    # float32 (k, 5) no formato YOLO; seeds: uma semente por amostra. Devolve (lote, caixas)
+    config = dict(AUGMENT_DEFAULTS, **(config or {}))
+    n, height, width, _ = batch.shape
+    params = [sample_params(seed, config) for seed in seeds]
+    boxes = [b.copy() for b in boxes]
+
+    # Brilho/contraste/HSV: o lote inteiro como uma imagem (N*H, W) para o cvtColor
+    hsv = cv2.cvtColor(batch.reshape(n * height, width, 3), cv2.COLOR_BGR2HSV).reshape(batch.shape)
+    for i, lut in enumerate(build_luts(params)):
+        cv2.LUT(hsv[i], lut, dst=hsv[i])
+    batch = cv2.cvtColor(hsv.reshape(n * height, width, 3), cv2.COLOR_HSV2BGR).reshape(batch.shape)
+
+    # Espelhamentos (centro x -> 1 - x, centro y -> 1 - y)
+    hflip = np.array([p['hflip'] for p in params], dtype=bool)
+    vflip = np.array([p['vflip'] for p in params], dtype=bool)
+    if hflip.any():
+        batch[hflip] = batch[hflip][:, :, ::-1]
+    if vflip.any():
+        batch[vflip] = batch[vflip][:, ::-1]
+    for i in range(n):
+        if hflip[i]:
+            boxes[i][:, 1] = 1 - boxes[i][:, 1]
+        if vflip[i]:
+            boxes[i][:, 2] = 1 - boxes[i][:, 2]
+
+    # Desfoque e ruido so nas amostras sorteadas
+    for i, p in enumerate(params):
+        if p['blur_sigma'] > 0:
+            cv2.GaussianBlur(batch[i], (0, 0), p['blur_sigma'], dst=batch[i])
+        if p['noise_std'] > 0:
+            # Ruido gaussiano do gerador do OpenCV (bem mais rapido que o do numpy), ressemeado por amostra
+            cv2.setRNGSeed(p['noise_seed'])
+            noise = np.empty(batch[i].shape, dtype=np.int16)
+            cv2.randn(noise.reshape(height, -1), 0, p['noise_std'])
+            cv2.add(batch[i], noise, dst=batch[i], dtype=cv2.CV_8U)
+
+    return batch, boxes
+
+
+def augment_samples(images, boxes, seeds, config=None):
+    # Versao para listas de imagens de tamanhos quaisquer: agrupa as de mesmo tamanho em lotes,
+    # aumenta cada lote e devolve as listas na ordem original
+    images = list(images)
+    boxes = list(boxes)
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(i)
+
+    for indices in groups.values():
+        batch, batch_boxes = augment_batch(np.stack([images[i] for i in indices]), [boxes[i] for i in indices],
+                                           [seeds[i] for i in indices], config)
+        for k, i in enumerate(indices):
+            images[i] = batch[k]
+            boxes[i] = batch_boxes[k]
+    return images, boxes
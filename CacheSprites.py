@@ -0,0 +1,162 @@
+import os
+from collections import OrderedDict
+
+import cv2
+
+# Orçamento padrão do cache, por processo
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def premultiply_alpha(tree):
+    # Garante que o sprite tenha 4 canais (BGRA). PNGs sem transparencia ficam totalmente opacos
+    if tree.ndim == 2:
+        tree = cv2.cvtColor(tree, cv2.COLOR_GRAY2BGRA)
+    elif tree.shape[2] == 3:
+        tree = cv2.cvtColor(tree, cv2.COLOR_BGR2BGRA)
+    else:
+        tree = tree.copy()
+
+    # Multiplica as cores pelo alfa (alfa pre-multiplicado). Assim a colagem vira apenas
+    # cor_arvore + fundo * (1 - alfa) e o redimensionamento nao "vaza" a cor dos pixels transparentes
+    alpha = tree[:, :, 3]
+    tree[:, :, :3] = cv2.multiply(tree[:, :, :3], cv2.merge([alpha, alpha, alpha]), scale=1.0 / 255)
+    return tree
+
+
+class SpriteCache:
+    # Cache LRU de sprites de arvore ja decodificados (BGRA uint8 com alfa pre-multiplicado).
+    # Cada PNG e lido do disco uma unica vez; as versoes redimensionadas ficam guardadas
+    # com a chave (arquivo, recorte, (largura, altura)). Quando o total de bytes passa de max_bytes,
+    # as entradas usadas ha mais tempo sao descartadas.
+    # crop_box = (x, y, largura, altura) recorta o sprite (ex.: na caixa justa do alfa, ver CatalogoArvores.py)
+    # antes de qualquer outra coisa, entao margens transparentes nao sao redimensionadas nem coladas.
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        sprite = self._entries.get(key)
+        if sprite is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return sprite
+
+    def _store(self, key, sprite):
+        # Os arrays guardados sao compartilhados entre as colagens, entao ficam somente leitura
+        sprite.setflags(write=False)
+
+        # Um sprite maior que o orcamento inteiro nao e guardado (mas continua sendo retornado)
+        if sprite.nbytes > self.max_bytes:
+            return sprite
+
+        self._entries[key] = sprite
+        self.current_bytes += sprite.nbytes
+        self._evict()
+        return sprite
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        # Muda o orçamento; se diminuir, descarta as entradas usadas há mais tempo até caber
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def get(self, tree_path, crop_box=None):
+        # Retorna o sprite no tamanho original, decodificando o PNG apenas na primeira vez
+        crop_box = tuple(int(v) for v in crop_box) if crop_box is not None else None
+        key = (tree_path, crop_box, None)
+        sprite = self._lookup(key)
+        if sprite is not None:
+            return sprite
+
+        # cv2.IMREAD_UNCHANGED -> le todos os canais, inclusive o alfa
+        tree = cv2.imread(tree_path, cv2.IMREAD_UNCHANGED)
+        if tree is None:
+            return None
+        if crop_box is not None:
+            x, y, width, height = crop_box
+            tree = tree[y:y+height, x:x+width]
+        return self._store(key, premultiply_alpha(tree))
+
+    def get_resized(self, tree_path, size, crop_box=None):
+        # Retorna o sprite redimensionado para size = (largura, altura), memoizado por (arquivo, recorte, tamanho)
+        size = (int(size[0]), int(size[1]))
+        crop_box = tuple(int(v) for v in crop_box) if crop_box is not None else None
+        key = (tree_path, crop_box, size)
+        sprite = self._lookup(key)
+        if sprite is not None:
+            return sprite
+
+        original = self.get(tree_path, crop_box)
+        if original is None:
+            return None
+        if original.shape[1] == size[0] and original.shape[0] == size[1]:
+            return original
+
+        resized = cv2.resize(original, size, interpolation=cv2.INTER_AREA)
+        return self._store(key, resized)
+
+    def get_scaled(self, tree_path, size, crop_box=None):
+        # Sprite em size = (largura, altura) a partir da piramide em disco (ver PiramidesSprites.py): so o
+        # nivel mais proximo fica no cache e o resize final, pequeno, nao e guardado (com escalas sorteadas
+        # quase nunca se repete). Sem a piramide no disco, reduz a partir do sprite original
+        # Import aqui dentro: PiramidesSprites importa premultiply_alpha deste modulo
+        from PiramidesSprites import choose_level, level_sizes, load_level, pyramid_path
+
+        size = (int(size[0]), int(size[1]))
+        crop_box = tuple(int(v) for v in crop_box) if crop_box is not None else None
+        path = pyramid_path(tree_path, crop_box)
+
+        # As piramides sao montadas pela caixa do alfa (crop_box), que da o tamanho de cada nivel sem ler nada
+        if crop_box is None or not os.path.exists(path):
+            level = self.get(tree_path, crop_box)
+        else:
+            index = choose_level(level_sizes(crop_box[2], crop_box[3]), size)
+            key = (tree_path, crop_box, ('level', index))
+            level = self._lookup(key)
+            if level is None:
+                level = self._store(key, load_level(path, index))
+        if level is None:
+            return None
+
+        if level.shape[1] == size[0] and level.shape[0] == size[1]:
+            return level
+        # INTER_AREA para reduzir, INTER_LINEAR se a escala pedida for maior que o sprite original
+        interpolation = cv2.INTER_AREA if size[0] <= level.shape[1] else cv2.INTER_LINEAR
+        resized = cv2.resize(level, size, interpolation=interpolation)
+        resized.setflags(write=False)
+        return resized
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def __repr__(self):
+        return (f"SpriteCache(entries={len(self._entries)}, "
+                f"bytes={self.current_bytes}/{self.max_bytes})")
@@ -0,0 +1,163 @@
+import os
+import struct
+import time
+
+import cv2
+
+# Leitura de imagens compartilhada pelas etapas do pipeline (fundos, redimensionamento, conversão).
+# Quando o tamanho final é bem menor que o original, JPEGs são decodificados já reduzidos (1/2, 1/4 ou 1/8)
+# com as flags IMREAD_REDUCED_* do OpenCV: o decodificador pula parte da IDCT, gasta menos CPU e memória,
+# e o resize que vem depois é menor. Nos outros casos é feita a leitura completa, como antes.
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+REDUCED_FLAGS = {
+    False: {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8},
+    True: {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
+# Marcadores SOF (start of frame) do JPEG, onde ficam altura e largura
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def sniff_format(header):
+    # Formato pelos primeiros bytes do arquivo (não pela extensão): 'jpeg', 'png' ou None
+    if header.startswith(JPEG_MAGIC):
+        return 'jpeg'
+    if header.startswith(PNG_MAGIC):
+        return 'png'
+    return None
+
+
+def read_jpeg_size(f):
+    # Percorre os segmentos do JPEG até o SOF, sem decodificar nada
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        # Bytes 0xFF de preenchimento entre segmentos
+        while marker[1] == 0xFF:
+            marker = marker[1:] + f.read(1)
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def image_size(path):
+    # (largura, altura) lida só do cabeçalho (JPEG ou PNG); None para outros formatos ou arquivo estranho.
+    # No JPEG não considera a rotação do EXIF (ver load_image)
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(24)
+            image_format = sniff_format(header)
+            if image_format == 'png' and header[12:16] == b'IHDR':
+                return struct.unpack('>II', header[16:24])
+            if image_format == 'jpeg':
+                return read_jpeg_size(f)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def reduction_factor(size, target_size, fit='cover'):
+    # Maior fator (8, 4, 2 ou 1) que ainda deixa a imagem reduzida com tamanho suficiente para target_size,
+    # de forma que o resize final só diminui a imagem:
+    #   fit='cover'  -> largura E altura reduzidas >= alvo (stretch, crop, tiles)
+    #   fit='inside' -> largura OU altura reduzida >= alvo (letterbox: a imagem cabe dentro do alvo)
+    width, height = size
+    target_width, target_height = target_size
+    for factor in (8, 4, 2):
+        fits_width = width / factor >= target_width
+        fits_height = height / factor >= target_height
+        if (fits_width and fits_height) if fit == 'cover' else (fits_width or fits_height):
+            return factor
+    return 1
+
+
+class DecodeStats:
+    # Contadores de leitura. O tempo economizado é estimado com o custo médio por pixel das leituras
+    # completas da mesma execução (sem nenhuma leitura completa não há como estimar)
+
+    def __init__(self):
+        self.full_count = 0
+        self.full_seconds = 0.0
+        self.full_pixels = 0
+        self.reduced_count = 0
+        self.reduced_seconds = 0.0
+        self.reduced_original_pixels = 0
+
+    def merge(self, other):
+        # Soma os contadores de outro DecodeStats (ex.: devolvido por um processo do pool)
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+        return self
+
+    def saved_seconds(self):
+        if not self.full_pixels or not self.reduced_count:
+            return None
+        full_cost = self.full_seconds / self.full_pixels * self.reduced_original_pixels
+        return full_cost - self.reduced_seconds
+
+    def report(self):
+        text = f"Leituras: {self.full_count} completas, {self.reduced_count} reduzidas"
+        saved = self.saved_seconds()
+        if saved is not None:
+            text += f" (~{saved:.1f}s economizados na decodificação)"
+        return text
+
+
+# Contadores do processo atual
+decode_stats = DecodeStats()
+
+
+def load_image(path, target_size=None, fit='cover', grayscale=False, stats=None):
+    # Lê a imagem em BGR (ou cinza). Com target_size = (largura, altura), um JPEG grande o bastante é
+    # decodificado já reduzido; o resultado continua >= target_size (ver reduction_factor) e quem chama
+    # faz o resize final. Devolve None se não conseguiu ler
+    if stats is None:
+        stats = decode_stats
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+
+    size = image_size(path) if target_size is not None else None
+    factor = 1
+    if size is not None:
+        with open(path, 'rb') as f:
+            is_jpeg = sniff_format(f.read(3)) == 'jpeg'
+        if is_jpeg:
+            factor = reduction_factor(size, target_size, fit)
+
+    start = time.perf_counter()
+    if factor > 1:
+        img = cv2.imread(path, REDUCED_FLAGS[grayscale][factor])
+        # Imagem rodada pelo EXIF (largura e altura trocadas) pode ter ficado pequena demais: lê inteira
+        if img is not None and reduction_factor((img.shape[1] * factor, img.shape[0] * factor), target_size, fit) \
+                >= factor:
+            stats.reduced_count += 1
+            stats.reduced_seconds += time.perf_counter() - start
+            stats.reduced_original_pixels += size[0] * size[1]
+            return img
+        start = time.perf_counter()
+
+    img = cv2.imread(path, flags)
+    if img is not None:
+        stats.full_count += 1
+        stats.full_seconds += time.perf_counter() - start
+        stats.full_pixels += img.shape[0] * img.shape[1]
+    return img
+
+
+def load_resized(path, size, interpolation=cv2.INTER_AREA, grayscale=False, stats=None):
+    # Lê e redimensiona para exatamente size = (largura, altura), pelo caminho mais barato
+    img = load_image(path, size, 'cover', grayscale, stats)
+    if img is None or (img.shape[1], img.shape[0]) == tuple(size):
+        return img
+    return cv2.resize(img, tuple(size), interpolation=interpolation)
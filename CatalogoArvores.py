@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import random
+from bisect import bisect_right
+
+import cv2
+import numpy as np
+
+# Indice guardado ao lado dos PNGs com tamanho e caixa justa do alfa de cada arvore.
+# So arvores novas ou modificadas (tamanho/data do arquivo) sao decodificadas de novo
+TREE_INDEX_FILENAME = '.tree_index.json'
+
+# Pixels com alfa <= ALPHA_THRESHOLD contam como transparentes ao calcular a caixa justa
+ALPHA_THRESHOLD = 8
+
+
+def alpha_bounding_box(tree, alpha_threshold=ALPHA_THRESHOLD):
+    # Caixa justa (x, y, largura, altura) dos pixels com alfa > alpha_threshold.
+    # Imagens sem canal alfa sao totalmente opacas (caixa = imagem inteira)
+    tree_height, tree_width = tree.shape[:2]
+    if tree.ndim < 3 or tree.shape[2] != 4:
+        return (0, 0, tree_width, tree_height)
+    _, mask = cv2.threshold(tree[:, :, 3], alpha_threshold, 255, cv2.THRESH_BINARY)
+    return cv2.boundingRect(mask)
+
+
+class TreeCatalog:
+    # Catalogo das arvores de uma pasta, montado uma unica vez por execucao (em vez de um os.listdir
+    # + um stat por arquivo a cada composicao). Guarda em arrays: nome, largura, altura, caixa do alfa
+    # (x, y, largura, altura dos pixels nao transparentes) e proporcao largura/altura da caixa do alfa.
+    #
+    # Modos de sorteio (todos O(k) por composicao, sem repetir arvore dentro da mesma composicao):
+    #   'uniform'  -> qualquer arvore com a mesma chance
+    #   'weighted' -> chance proporcional a weights
+    #   'cycle'    -> sem reposicao ao longo da execucao: percorre uma permutacao de todas as arvores
+    #                 antes de repetir alguma (substitui o set(all_images) - set(used_images) do MontaDataset4)
+
+    def __init__(self, tree_directory, names, sizes, alpha_boxes, weights=None):
+        self.tree_directory = tree_directory
+        self.names = list(names)
+        self.sizes = np.asarray(sizes, dtype=np.int32).reshape(-1, 2)                # (largura, altura)
+        self.alpha_boxes = np.asarray(alpha_boxes, dtype=np.int32).reshape(-1, 4)    # (x, y, largura, altura)
+        self.aspect_ratios = self.alpha_boxes[:, 2] / np.maximum(self.alpha_boxes[:, 3], 1)
+        self.set_weights(weights)
+        self._cycles = {}
+
+    @classmethod
+    def build(cls, tree_directory, weights=None, alpha_threshold=ALPHA_THRESHOLD):
+        # Lista a pasta uma vez (ordenada, para o sorteio ser reproduzivel). Tamanho e caixa do alfa vem
+        # do indice ao lado dos PNGs; so arvores novas/modificadas sao decodificadas (e o indice atualizado)
+        index_path = os.path.join(tree_directory, TREE_INDEX_FILENAME)
+        cached = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+                if index.get('alpha_threshold') == alpha_threshold:
+                    cached = index.get('trees', {})
+            except (OSError, ValueError):
+                print(f"Indice de arvores inválido, sera refeito: {index_path}")
+
+        names, sizes, alpha_boxes = [], [], []
+        entries = {}
+        for filename in sorted(os.listdir(tree_directory)):
+            path = os.path.join(tree_directory, filename)
+            if os.path.splitext(filename)[1].lower() not in ['.png'] or not os.path.isfile(path):
+                continue
+
+            # Entrada: [tamanho do arquivo, data de modificacao, largura, altura, x, y, largura, altura do alfa]
+            stat = os.stat(path)
+            entry = cached.get(filename)
+            if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                tree = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+                if tree is None:
+                    print(f"Imagem não conseguiu ser lida: {path}")
+                    continue
+                tree_height, tree_width = tree.shape[:2]
+                entry = [stat.st_size, stat.st_mtime_ns, tree_width, tree_height,
+                         *alpha_bounding_box(tree, alpha_threshold)]
+            entries[filename] = entry
+
+            # Arvore totalmente transparente nao tem o que colar
+            if entry[6] == 0 or entry[7] == 0:
+                print(f"Arvore sem pixels visiveis, ignorada: {path}")
+                continue
+
+            names.append(filename)
+            sizes.append(entry[2:4])
+            alpha_boxes.append(entry[4:8])
+
+        if entries != cached:
+            try:
+                tmp_path = index_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({'alpha_threshold': alpha_threshold, 'trees': entries}, f)
+                os.replace(tmp_path, index_path)
+            except OSError as e:
+                print(f"Nao foi possivel salvar o indice de arvores ({e}); ele sera recalculado na proxima execucao")
+
+        return cls(tree_directory, names, sizes, alpha_boxes, weights)
+
+    def __len__(self):
+        return len(self.names)
+
+    def set_weights(self, weights):
+        # weights: None (uniforme), lista/array com um peso por arvore ou dict {nome: peso} (nomes ausentes = 1)
+        if weights is None:
+            weights = np.ones(len(self.names))
+        elif isinstance(weights, dict):
+            weights = np.array([weights.get(name, 1.0) for name in self.names], dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self._cum_weights = np.cumsum(self.weights).tolist()
+
+    def paths(self, indices):
+        return [os.path.join(self.tree_directory, self.names[i]) for i in indices]
+
+    def crop_boxes(self, indices):
+        # Caixas justas do alfa, no formato crop_box do SpriteCache
+        return [tuple(int(v) for v in self.alpha_boxes[i]) for i in indices]
+
+    def _cycle_permutation(self, seed, epoch):
+        # Permutacao de todas as arvores para a "volta" epoch; guarda so a ultima de cada semente
+        key = (seed, epoch)
+        if key not in self._cycles:
+            digest = hashlib.sha256(f"{seed}/cycle/{epoch}".encode('utf-8')).digest()
+            permutation = list(range(len(self.names)))
+            random.Random(int.from_bytes(digest[:8], 'little')).shuffle(permutation)
+            self._cycles = {k: v for k, v in self._cycles.items() if k[0] != seed}
+            self._cycles[key] = permutation
+        return self._cycles[key]
+
+    def sample(self, k, rng=random, mode='uniform', job_index=0, seed=0):
+        # Devolve k indices de arvores distintas.
+        # No modo 'cycle' o resultado depende so de (seed, job_index): a composicao numero job_index
+        # pega as arvores k*job_index ... k*job_index + k - 1 da sequencia de permutacoes
+        n = len(self.names)
+        if k > n:
+            raise ValueError(f"Pedidas {k} arvores, mas o catalogo tem {n}")
+
+        if mode == 'uniform':
+            return rng.sample(range(n), k)
+
+        if mode == 'weighted':
+            if np.count_nonzero(self.weights > 0) < k:
+                raise ValueError(f"Pedidas {k} arvores, mas so {np.count_nonzero(self.weights > 0)} tem peso positivo")
+            selected = []
+            total = self._cum_weights[-1]
+            while len(selected) < k:
+                index = bisect_right(self._cum_weights, rng.random() * total)
+                index = min(index, n - 1)
+                if index not in selected:
+                    selected.append(index)
+            return selected
+
+        if mode == 'cycle':
+            selected = []
+            position = job_index * k
+            while len(selected) < k:
+                epoch, offset = divmod(position, n)
+                index = self._cycle_permutation(seed, epoch)[offset]
+                # Na virada de uma volta para a outra a mesma arvore poderia sair duas vezes
+                if index not in selected:
+                    selected.append(index)
+                position += 1
+            return selected
+
+        raise ValueError(f"Modo de sorteio inválido: {mode}")
+
+    def sample_paths(self, k, rng=random, mode='uniform', job_index=0, seed=0):
+        return self.paths(self.sample(k, rng, mode, job_index, seed))
+
+    def sample_trees(self, k, rng=random, mode='uniform', job_index=0, seed=0):
+        # Caminhos e caixas justas do alfa das arvores sorteadas
+        indices = self.sample(k, rng, mode, job_index, seed)
+        return self.paths(indices), self.crop_boxes(indices)
@@ -0,0 +1,123 @@
+import sys
+import time
+
+import cv2
+import numpy as np
+
+
+class BlendScratch:
+    # Buffers de trabalho reaproveitados entre as colagens, para que o blending nao aloque memoria.
+    # Crescem sob demanda ate o maior sprite ja colado. Cada processo/thread deve usar o seu.
+
+    def __init__(self):
+        self._alpha = np.empty(0, dtype=np.uint8)
+        self._inverse_alpha = np.empty(0, dtype=np.uint8)
+        self._foreground = np.empty(0, dtype=np.uint8)
+
+    def views(self, height, width):
+        area = height * width
+        if self._alpha.size < area:
+            self._alpha = np.empty(area, dtype=np.uint8)
+            self._inverse_alpha = np.empty(area * 3, dtype=np.uint8)
+            self._foreground = np.empty(area * 3, dtype=np.uint8)
+
+        # Visoes contiguas do tamanho do sprite atual (o OpenCV escreve direto nelas via dst=)
+        alpha = self._alpha[:area].reshape(height, width)
+        inverse_alpha = self._inverse_alpha[:area * 3].reshape(height, width, 3)
+        foreground = self._foreground[:area * 3].reshape(height, width, 3)
+        return alpha, inverse_alpha, foreground
+
+
+# Buffers usados quando quem chama nao passa os seus
+default_scratch = BlendScratch()
+
+
+def blend_premultiplied(base_img, sprite, x_offset, y_offset, scratch=None):
+    # Cola um sprite BGRA com alfa pre-multiplicado sobre a imagem BGR base, no proprio lugar.
+    # Os tres canais sao misturados de uma vez: roi = sprite_bgr + roi * (255 - alfa) / 255
+    # Toda a conta e feita em uint8 (aritmetica de ponto fixo do OpenCV, com arredondamento)
+    # direto na regiao de interesse, sem converter a imagem inteira para BGRA.
+    if scratch is None:
+        scratch = default_scratch
+
+    tree_height, tree_width = sprite.shape[:2]
+    roi = base_img[y_offset:y_offset+tree_height, x_offset:x_offset+tree_width]
+    alpha, inverse_alpha, foreground = scratch.views(tree_height, tree_width)
+
+    # Alfa inverso replicado nos 3 canais e cor da arvore sem o canal alfa, ambos nos buffers
+    cv2.extractChannel(sprite, 3, dst=alpha)
+    cv2.bitwise_not(alpha, dst=alpha)
+    cv2.cvtColor(alpha, cv2.COLOR_GRAY2BGR, dst=inverse_alpha)
+    cv2.cvtColor(sprite, cv2.COLOR_BGRA2BGR, dst=foreground)
+
+    cv2.multiply(roi, inverse_alpha, dst=roi, scale=1.0 / 255)
+    cv2.add(roi, foreground, dst=roi)
+    return base_img
+
+
+def blend_legacy(base_img, sprite, x_offset, y_offset):
+    # Implementacao antiga (canal a canal em float64), sobre o fundo ja em BGRA e no proprio lugar: o codigo
+    # antigo convertia a imagem inteira para BGRA (e de volta) uma vez por composicao, nao por colagem.
+    # Mantida apenas como referencia para o benchmark
+    tree_height, tree_width = sprite.shape[:2]
+
+    alpha_channel = sprite[:, :, 3] / 255.0
+    inverse_alpha = 1.0 - alpha_channel
+
+    for current_channel in range(0, 3):
+        roi = base_img[y_offset:y_offset+tree_height, x_offset:x_offset+tree_width, current_channel]
+        base_img[y_offset:y_offset+tree_height, x_offset:x_offset+tree_width, current_channel] = (sprite[:, :, current_channel] + inverse_alpha * roi)
+
+    return base_img
+
+
+def benchmark_blend(base_path=None, tree_path=None, pastes=300):
+    # Micro-benchmark de uma colagem: implementacao antiga x kernel novo.
+    # Sem caminhos, usa um fundo 1024x768 e um sprite 220x300 aleatorios
+    from CacheSprites import premultiply_alpha
+
+    rng = np.random.default_rng(0)
+    base_img = cv2.imread(base_path) if base_path else None
+    if base_img is None:
+        base_img = rng.integers(0, 256, (768, 1024, 3), dtype=np.uint8)
+    tree = cv2.imread(tree_path, cv2.IMREAD_UNCHANGED) if tree_path else None
+    if tree is None:
+        tree = rng.integers(0, 256, (300, 220, 4), dtype=np.uint8)
+    sprite = premultiply_alpha(tree)
+
+    tree_height, tree_width = sprite.shape[:2]
+    base_height, base_width = base_img.shape[:2]
+    offsets = [(int(rng.integers(0, base_width - tree_width + 1)), int(rng.integers(0, base_height - tree_height + 1)))
+               for _ in range(pastes)]
+
+    # Confere que os dois caminhos produzem a mesma imagem (diferenca maxima de 1 por arredondamento)
+    reference = cv2.cvtColor(blend_legacy(cv2.cvtColor(base_img, cv2.COLOR_BGR2BGRA), sprite, *offsets[0]),
+                             cv2.COLOR_BGRA2BGR)
+    result = blend_premultiplied(base_img.copy(), sprite, *offsets[0])
+    max_diff = int(np.abs(reference.astype(np.int16) - result).max())
+
+    # As conversoes BGR <-> BGRA do codigo antigo acontecem uma vez por composicao, fora da medicao,
+    # para que o tempo por colagem compare so a mistura
+    legacy_img = cv2.cvtColor(base_img, cv2.COLOR_BGR2BGRA)
+    start = time.perf_counter()
+    for x_offset, y_offset in offsets:
+        blend_legacy(legacy_img, sprite, x_offset, y_offset)
+    legacy_time = (time.perf_counter() - start) / pastes
+
+    kernel_img = base_img.copy()
+    scratch = BlendScratch()
+    start = time.perf_counter()
+    for x_offset, y_offset in offsets:
+        blend_premultiplied(kernel_img, sprite, x_offset, y_offset, scratch)
+    kernel_time = (time.perf_counter() - start) / pastes
+
+    print(f"Fundo {base_width}x{base_height}, sprite {tree_width}x{tree_height}, {pastes} colagens")
+    print(f"Antigo (float64 por canal, BGRA):  {legacy_time * 1e6:9.1f} us/colagem")
+    print(f"Kernel (uint8, 3 canais, buffers):  {kernel_time * 1e6:9.1f} us/colagem")
+    print(f"Speedup: {legacy_time / kernel_time:.1f}x  (diferenca maxima entre os dois: {max_diff})")
+    return legacy_time, kernel_time
+
+
+if __name__ == '__main__':
+    # Uso: python Composicao.py [imagem_de_fundo] [arvore_png]
+    benchmark_blend(*sys.argv[1:3])
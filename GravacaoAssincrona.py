@@ -0,0 +1,249 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+
+# Gravação das composições em segundo plano, em duas etapas com pools de threads próprios:
+#   compositor -> [fila de codificação] -> cv2.imencode -> [fila de gravação] -> arquivos (imagem + label)
+# O cv2.imencode e a escrita em disco liberam o GIL, então enquanto uma composição é codificada e a
+# anterior está sendo gravada, o compositor já monta a próxima. O número de imagens em andamento é
+# limitado (max_pending): quando as filas enchem, submit espera, e a memória não cresce sem limite.
+
+# Política de fsync: 'never' deixa a cargo do sistema operacional; 'each' sincroniza cada arquivo ao
+# gravar; 'batch' sincroniza os arquivos em grupos de fsync_batch (e o que sobrar no flush/close). Com 'batch'
+# o Future de uma imagem só fica pronto depois do fsync do grupo dela, então quem registra as saídas a partir
+# dos Futures (ex.: o manifesto) só vê arquivos já no disco
+FSYNC_POLICIES = ('never', 'batch', 'each')
+
+
+def encode_params(image_ext, jpeg_quality=95, jpeg_optimize=False):
+    # Parâmetros do cv2.imencode/imwrite para a extensão (95 e sem otimização são os padrões do OpenCV)
+    if image_ext.lower() in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality), cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(jpeg_optimize))]
+    return []
+
+
+def fsync_path(path):
+    # Sincroniza um arquivo (ou pasta) já gravado
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriterStats:
+    # Contadores do AsyncWriter. As profundidades das filas são amostradas a cada submit (quantas imagens
+    # estavam esperando/sendo codificadas e gravadas); blocked_seconds é o tempo que o compositor ficou
+    # parado esperando vaga (se for alto, a gravação é o gargalo)
+
+    def __init__(self):
+        self.written = 0
+        self.failed = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+        self.fsync_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.samples = 0
+        self.encode_depth_sum = 0
+        self.write_depth_sum = 0
+        self.encode_depth_max = 0
+        self.write_depth_max = 0
+
+    def merge(self, other):
+        # Soma os contadores de outro WriterStats (ex.: devolvido por um processo do pool); máximos são máximos
+        for name, value in vars(other).items():
+            if name.endswith('_max'):
+                setattr(self, name, max(getattr(self, name), value))
+            else:
+                setattr(self, name, getattr(self, name) + value)
+        return self
+
+    def report(self):
+        samples = max(1, self.samples)
+        text = (f"Gravação: {self.written} imagens ({self.bytes / 2**20:.1f} MB), {self.failed} falhas -- "
+                f"codificação {self.encode_seconds:.1f}s, escrita {self.write_seconds:.1f}s")
+        if self.fsync_seconds:
+            text += f", fsync {self.fsync_seconds:.1f}s"
+        text += (f"; fila de codificação média {self.encode_depth_sum / samples:.1f} (máx. {self.encode_depth_max}), "
+                 f"fila de gravação média {self.write_depth_sum / samples:.1f} (máx. {self.write_depth_max}); "
+                 f"compositor esperou {self.blocked_seconds:.1f}s")
+        return text
+
+
+class AsyncWriter:
+    # Uso: with AsyncWriter(...) as writer: writer.submit(imagem, texto_do_label, caminho_imagem, caminho_label)
+    # submit devolve um Future com True/False (gravou ou não); completed devolve as imagens que já terminaram
+    # sem esperar as outras, e flush/close esperam tudo terminar. Feito para durar a execução inteira (um por
+    # processo): as filas não esvaziam entre um fundo e outro
+
+    def __init__(self, encode_workers=2, write_workers=2, max_pending=16, jpeg_quality=95, jpeg_optimize=False,
+                 fsync='never', fsync_batch=64):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync inválida: {fsync} (use uma de {FSYNC_POLICIES})")
+        self.jpeg_quality = jpeg_quality
+        self.jpeg_optimize = jpeg_optimize
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.stats = WriterStats()
+
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._encode_pool = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix='encode')
+        self._write_pool = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix='write')
+        self._encode_depth = 0
+        self._write_depth = 0
+        self._unsynced = []
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, image, label_text, image_path, label_path):
+        # A imagem é copiada: quem chama pode reaproveitar o buffer (ver MontaDataset5.render_background)
+        start = time.perf_counter()
+        self._slots.acquire()
+        blocked = time.perf_counter() - start
+        image = image.copy()
+
+        result = Future()
+        with self._lock:
+            self._encode_depth += 1
+            self.stats.blocked_seconds += blocked
+            self.stats.samples += 1
+            self.stats.encode_depth_sum += self._encode_depth
+            self.stats.write_depth_sum += self._write_depth
+            self.stats.encode_depth_max = max(self.stats.encode_depth_max, self._encode_depth)
+            self.stats.write_depth_max = max(self.stats.write_depth_max, self._write_depth)
+        self._pending.append((image_path, result))
+        self._encode_pool.submit(self._encode, image, label_text, image_path, label_path, result)
+        return result
+
+    def _finish(self, result, ok, resolve=True):
+        # Libera a vaga; resolve=False deixa o Future para depois do fsync do grupo (fsync='batch')
+        with self._lock:
+            if ok:
+                self.stats.written += 1
+            else:
+                self.stats.failed += 1
+        self._slots.release()
+        if resolve:
+            result.set_result(ok)
+
+    def _encode(self, image, label_text, image_path, label_path, result):
+        start = time.perf_counter()
+        image_ext = os.path.splitext(image_path)[1]
+        try:
+            params = encode_params(image_ext, self.jpeg_quality, self.jpeg_optimize)
+            ok, encoded = cv2.imencode(image_ext, image, params)
+        except cv2.error as e:
+            print(f"Não foi possivel codificar a imagem {image_path}: {e}")
+            ok = False
+        with self._lock:
+            self._encode_depth -= 1
+            self.stats.encode_seconds += time.perf_counter() - start
+            if ok:
+                self._write_depth += 1
+        if not ok:
+            self._finish(result, False)
+            return
+        self._write_pool.submit(self._write, encoded, label_text, image_path, label_path, result)
+
+    def _write(self, encoded, label_text, image_path, label_path, result):
+        start = time.perf_counter()
+        ok = True
+        try:
+            # Label primeiro e imagem depois, na mesma ordem de MontaDataset5.write_sample
+            with open(label_path, 'w') as txt_file:
+                txt_file.write(label_text)
+                if self.fsync == 'each':
+                    txt_file.flush()
+                    os.fsync(txt_file.fileno())
+            with open(image_path, 'wb') as image_file:
+                image_file.write(encoded.data)
+                if self.fsync == 'each':
+                    image_file.flush()
+                    os.fsync(image_file.fileno())
+        except OSError as e:
+            print(f"Não foi possivel gravar {image_path}: {e}")
+            ok = False
+        elapsed = time.perf_counter() - start
+
+        deferred = ok and self.fsync == 'batch'
+        to_sync = None
+        with self._lock:
+            self._write_depth -= 1
+            self.stats.write_seconds += elapsed
+            if ok:
+                self.stats.bytes += encoded.nbytes + len(label_text)
+            if deferred:
+                self._unsynced.append((label_path, image_path, result))
+                if len(self._unsynced) >= self.fsync_batch:
+                    to_sync, self._unsynced = self._unsynced, []
+        self._finish(result, ok, resolve=not deferred)
+        if to_sync:
+            self._sync(to_sync)
+
+    def _sync(self, entries):
+        # fsync dos arquivos e depois das pastas deles (para que as entradas novas também fiquem no disco);
+        # só então as imagens do grupo contam como gravadas. Se o fsync falhar, o grupo inteiro conta como
+        # não gravado (os Futures precisam ser resolvidos de qualquer jeito, senão flush/close esperam para sempre)
+        start = time.perf_counter()
+        paths = [path for label_path, image_path, _ in entries for path in (label_path, image_path)]
+        ok = True
+        try:
+            for path in paths:
+                fsync_path(path)
+            for directory in sorted({os.path.dirname(path) for path in paths}):
+                fsync_path(directory)
+        except OSError as e:
+            print(f"Não foi possivel sincronizar {len(entries)} imagens ({e})")
+            ok = False
+        with self._lock:
+            self.stats.fsync_seconds += time.perf_counter() - start
+            if not ok:
+                self.stats.written -= len(entries)
+                self.stats.failed += len(entries)
+        for _, _, result in entries:
+            result.set_result(ok)
+
+    def completed(self):
+        # Imagens que já terminaram desde a última chamada, como (caminho da imagem, gravou), sem esperar as outras
+        done = []
+        pending = []
+        for path, future in self._pending:
+            if future.done():
+                done.append((path, future.result()))
+            else:
+                pending.append((path, future))
+        self._pending = pending
+        return done
+
+    def flush(self):
+        # Espera todas as imagens enviadas (e o fsync das que faltam) e devolve (caminho da imagem, gravou)
+        # de cada uma que ainda não tinha saído em completed, na ordem dos submits
+        # Pega todas as vagas: com elas, nenhuma imagem está mais sendo codificada ou gravada
+        for _ in range(self.max_pending):
+            self._slots.acquire()
+        with self._lock:
+            to_sync, self._unsynced = self._unsynced, []
+        if to_sync:
+            self._sync(to_sync)
+        for _ in range(self.max_pending):
+            self._slots.release()
+
+        pending, self._pending = self._pending, []
+        return [(path, future.result()) for path, future in pending]
+
+    def close(self):
+        results = self.flush()
+        self._encode_pool.shutdown()
+        self._write_pool.shutdown()
+        return results
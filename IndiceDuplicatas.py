@@ -0,0 +1,260 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from CatalogoArvores import ALPHA_THRESHOLD
+
+# Indice de hashes perceptuais (dHash + pHash, 64 bits cada) para achar imagens quase repetidas
+# (ex.: as varias copias do conjunto de sprites em ImagensArvores e as pastas de Fundos que se sobrepoem).
+# Os hashes ficam num JSON (por padrao ao lado das imagens); so arquivos novos ou modificados
+# (tamanho/data) sao lidos de novo. A busca usa uma BK-tree com a distancia de Hamming do dHash,
+# entao nao compara cada imagem com todas as outras
+PERCEPTUAL_INDEX_FILENAME = '.perceptual_index.json'
+
+# Duas imagens sao quase repetidas se dHash E pHash diferem em no maximo DUPLICATE_DISTANCE bits
+DUPLICATE_DISTANCE = 4
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+
+def to_gray(img, alpha_threshold=ALPHA_THRESHOLD):
+    # Cinza; pixels transparentes viram preto (o mesmo sprite com fundos transparentes diferentes bate)
+    if img.ndim == 2:
+        return img
+    if img.shape[2] == 4:
+        _, mask = cv2.threshold(img[:, :, 3], alpha_threshold, 255, cv2.THRESH_BINARY)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+        return cv2.bitwise_and(gray, mask)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def dhash(img, hash_size=8):
+    # Difference hash: reduz para (hash_size + 1) x hash_size em cinza e compara pixels vizinhos.
+    # Devolve um inteiro de hash_size * hash_size bits
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def phash(img, hash_size=8):
+    # Perceptual hash: DCT da imagem reduzida para 32x32, bits = coeficientes de baixa frequencia acima da mediana
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size]
+    # O coeficiente DC (brilho medio) fica fora da mediana
+    bits = (low > np.median(low.ravel()[1:])).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def hash_image(path):
+    # Roda nos processos do pool. Devolve (caminho, dhash, phash) ou (caminho, None, None) se nao leu
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return path, None, None
+    gray = to_gray(img)
+    return path, dhash(gray), phash(gray)
+
+
+class BKTree:
+    # BK-tree sobre a distancia de Hamming: cada no guarda um hash, os itens com esse hash e os filhos
+    # indexados pela distancia ate ele. A busca so desce nos filhos com |d - distancia| <= max_distance
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        # Lista de (distancia, item) com distancia <= max_distance
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+
+class PerceptualIndex:
+    # entries: {caminho relativo a pasta do indice: [tamanho, data de modificacao, dhash, phash]}
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.base_directory = os.path.dirname(os.path.abspath(index_path))
+        self.entries = {}
+        self._tree = None
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                print(f"Indice de hashes inválido, sera refeito: {index_path}")
+
+    @classmethod
+    def for_directory(cls, directory, workers=1):
+        # Indice guardado ao lado das imagens da pasta, ja atualizado
+        index = cls(os.path.join(directory, PERCEPTUAL_INDEX_FILENAME))
+        index.update([directory], workers)
+        return index
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_directory)
+
+    def path(self, key):
+        return os.path.normpath(os.path.join(self.base_directory, key))
+
+    def update(self, directories, workers=1, chunksize=None):
+        # Sincroniza o indice com as pastas: hash das imagens novas/modificadas (em paralelo),
+        # remove as que sumiram e salva o indice se algo mudou
+        start = time.perf_counter()
+        current = {}
+        for directory in directories:
+            for filename in sorted(os.listdir(directory)):
+                path = os.path.join(directory, filename)
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS and os.path.isfile(path):
+                    stat = os.stat(path)
+                    current[self._key(path)] = [stat.st_size, stat.st_mtime_ns]
+
+        # So as entradas das pastas atualizadas podem ser removidas (o indice pode cobrir outras pastas)
+        updated_dirs = {self._key(directory) for directory in directories}
+        entries = {key: entry for key, entry in self.entries.items()
+                   if key in current or (os.path.dirname(key) or '.') not in updated_dirs}
+        stale = [key for key, signature in current.items()
+                 if key not in entries or entries[key][:2] != signature]
+
+        paths = [self.path(key) for key in stale]
+        if workers > 1 and len(paths) > 1:
+            if chunksize is None:
+                chunksize = max(1, len(paths) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(hash_image, paths, chunksize=chunksize))
+        else:
+            results = list(map(hash_image, paths))
+
+        for path, d, p in results:
+            key = self._key(path)
+            if d is None:
+                print(f"Imagem não conseguiu ser lida: {path}")
+                entries.pop(key, None)
+                continue
+            entries[key] = current[key] + [d, p]
+
+        changed = entries != self.entries
+        self.entries = entries
+        self._tree = None
+        if changed:
+            self.save()
+        print(f"Indice de hashes: {len(self.entries)} imagens, {len(stale)} calculadas "
+              f"em {time.perf_counter() - start:.1f}s")
+
+    def save(self):
+        try:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Nao foi possivel salvar o indice de hashes ({e}); ele sera recalculado na proxima execucao")
+
+    def tree(self):
+        if self._tree is None:
+            self._tree = BKTree()
+            for key in sorted(self.entries):
+                self._tree.add(self.entries[key][2], key)
+        return self._tree
+
+    def near_duplicates(self, path, max_distance=DUPLICATE_DISTANCE):
+        # Caminhos quase repetidos de uma imagem ja indexada (sem ela mesma), do mais parecido ao menos
+        key = self._key(path)
+        _, _, d, p = self.entries[key]
+        found = [(distance, other) for distance, other in self.tree().search(d, max_distance)
+                 if other != key and hamming(p, self.entries[other][3]) <= max_distance]
+        return [self.path(other) for _, other in sorted(found)]
+
+    def duplicate_groups(self, paths=None, max_distance=DUPLICATE_DISTANCE):
+        # Agrupa as imagens quase repetidas (fechamento transitivo). Devolve {caminho: representante},
+        # o representante e o primeiro caminho do grupo em ordem alfabetica.
+        # paths: restringe a estas imagens (None = todas do indice)
+        keys = sorted(self.entries) if paths is None else sorted(self._key(path) for path in paths)
+        wanted = set(keys)
+        parent = {key: key for key in keys}
+
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        tree = self.tree()
+        for key in keys:
+            _, _, d, p = self.entries[key]
+            for _, other in tree.search(d, max_distance):
+                if other in wanted and other != key and hamming(p, self.entries[other][3]) <= max_distance:
+                    a, b = find(key), find(other)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+        return {self.path(key): self.path(find(key)) for key in keys}
+
+
+def unique_images(directory, filenames, max_distance=DUPLICATE_DISTANCE, workers=1):
+    # Filtra uma lista de nomes da pasta, mantendo so o representante de cada grupo de quase repetidas.
+    # Devolve (nomes mantidos, {nome: nome do representante} para todos os nomes)
+    index = PerceptualIndex.for_directory(directory, workers)
+    paths = [os.path.join(directory, f) for f in filenames if index._key(os.path.join(directory, f)) in index.entries]
+    groups = index.duplicate_groups(paths, max_distance)
+    representatives = {os.path.basename(path): os.path.basename(rep) for path, rep in groups.items()}
+    kept = [f for f in filenames if representatives.get(f, f) == f]
+    return kept, representatives
+
+
+if __name__ == '__main__':
+    # python IndiceDuplicatas.py pasta1 [pasta2 ...] -> grupos de imagens quase repetidas entre as pastas
+    # (indice compartilhado na pasta atual)
+    directories = sys.argv[1:] or ['ImagensArvores/Individuais_PNG_Transparente']
+    index = PerceptualIndex(PERCEPTUAL_INDEX_FILENAME)
+    index.update(directories, workers=os.cpu_count())
+
+    groups = {}
+    for path, representative in index.duplicate_groups().items():
+        groups.setdefault(representative, []).append(path)
+    groups = [members for members in groups.values() if len(members) > 1]
+    print(f"{len(groups)} grupos de imagens quase repetidas, "
+          f"{sum(len(members) - 1 for members in groups)} imagens a mais")
+    for members in groups[:20]:
+        print('  ' + ', '.join(members))
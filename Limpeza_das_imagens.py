@@ -1,62 +1,205 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 
-def browse_and_manage_images(directory):
-    # Arquivo para armazenar imagens analisadas
-    analyzed_file = 'analyzed_images.txt'
-    
-    # Carrega imagens analisadas do arquivo, se existir
-    if os.path.exists(analyzed_file):
-        with open(analyzed_file, 'r') as f:
-            analyzed_images = f.read().splitlines()
+# Log das decisões: uma linha JSON por tecla, sempre só acrescentada (nunca reescreve o arquivo inteiro)
+REVIEW_LOG_FILENAME = 'review_log.jsonl'
+# Arquivo antigo (um nome por linha); se existir, os nomes contam como já analisados
+LEGACY_ANALYZED_FILENAME = 'analyzed_images.txt'
+# Pasta (dentro do diretório revisado) para onde vão as imagens apagadas, para poder desfazer
+TRASH_DIRNAME = '_apagadas'
+
+
+class DecisionLog:
+    # decisions: {nome: 'kept' | 'deleted'}; um undo grava uma linha {'file': nome, 'undo': true}
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.decisions = {}
+
+        if legacy_path is not None and os.path.exists(legacy_path):
+            with open(legacy_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        self.decisions[line.strip()] = 'kept'
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Última linha cortada (programa fechado no meio da escrita)
+                        continue
+                    if record.get('undo'):
+                        self.decisions.pop(record['file'], None)
+                    else:
+                        self.decisions[record['file']] = record['decision']
+
+        self._log = open(path, 'a')
+
+    def __contains__(self, filename):
+        return filename in self.decisions
+
+    def _append(self, record):
+        self._log.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._log.flush()
+
+    def record(self, filename, decision):
+        self.decisions[filename] = decision
+        self._append({'file': filename, 'decision': decision})
+
+    def undo(self, filename):
+        self.decisions.pop(filename, None)
+        self._append({'file': filename, 'undo': True})
+
+    def close(self):
+        self._log.close()
+
+
+class ImagePrefetcher:
+    # Decodifica as próximas `ahead` imagens numa thread de fundo (o cv2.imread libera o GIL),
+    # então a próxima imagem já está pronta quando a tecla é pressionada
+
+    def __init__(self, paths, ahead=8, keep_behind=4):
+        self.paths = paths
+        self.ahead = ahead
+        self.keep_behind = keep_behind
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = {}
+
+    def get(self, index):
+        for i in range(index, min(index + self.ahead + 1, len(self.paths))):
+            if i not in self._futures:
+                self._futures[i] = self._executor.submit(cv2.imread, self.paths[i])
+        # Descarta o que ficou muito para trás (guarda algumas para o undo)
+        for i in [i for i in self._futures if i < index - self.keep_behind]:
+            del self._futures[i]
+        return self._futures[index].result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PendingDeletes:
+    # Apagar é adiado e feito em lotes: os arquivos vão para a pasta TRASH_DIRNAME (um rename, sem copiar)
+    # a cada batch_size decisões ou ao sair. Enquanto pendente ou na lixeira, dá para desfazer
+
+    def __init__(self, directory, batch_size=50):
+        self.directory = directory
+        self.trash_directory = os.path.join(directory, TRASH_DIRNAME)
+        self.batch_size = batch_size
+        self.pending = set()
+
+    def add(self, filename):
+        self.pending.add(filename)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def restore(self, filename):
+        if filename in self.pending:
+            self.pending.discard(filename)
+            return
+        trashed = os.path.join(self.trash_directory, filename)
+        if os.path.exists(trashed):
+            os.replace(trashed, os.path.join(self.directory, filename))
+
+    def flush(self):
+        if not self.pending:
+            return
+        os.makedirs(self.trash_directory, exist_ok=True)
+        for filename in self.pending:
+            filepath = os.path.join(self.directory, filename)
+            if os.path.exists(filepath):
+                os.replace(filepath, os.path.join(self.trash_directory, filename))
+        print(f"{len(self.pending)} imagens movidas para {self.trash_directory}")
+        self.pending.clear()
+
+    def empty_trash(self):
+        # Apaga de vez o que está na lixeira (não dá mais para desfazer)
+        self.flush()
+        if not os.path.isdir(self.trash_directory):
+            return
+        for filename in os.listdir(self.trash_directory):
+            os.remove(os.path.join(self.trash_directory, filename))
+
+
+def list_pending_images(directory, log):
+    # Arquivos do diretório que ainda não foram analisados (lookup em dict, O(1) por arquivo)
+    return sorted(entry.name for entry in os.scandir(directory)
+                  if entry.is_file()
+                  and entry.name.lower().endswith('.png')
+                  and entry.name not in log)
+
+
+def browse_and_manage_images(directory, files=None, log_path=REVIEW_LOG_FILENAME, delete_batch_size=50,
+                             empty_trash=False):
+    # Teclas: ESC sai, D apaga, U desfaz a última decisão (volta uma imagem), qualquer outra mantém.
+    # files: ordem de revisão (ex.: piores primeiro); None = todos os PNGs ainda não analisados, por nome
+    # empty_trash: ao sair, apaga de vez as imagens da lixeira (senão ficam em TRASH_DIRNAME)
+    log = DecisionLog(log_path, legacy_path=LEGACY_ANALYZED_FILENAME)
+    if files is None:
+        files = list_pending_images(directory, log)
     else:
-        analyzed_images = []
+        files = [f for f in files if f not in log]
 
-    # Obtém a lista de arquivos no diretório que ainda não foram analisados
-    files = [f for f in os.listdir(directory) 
-            if os.path.isfile(os.path.join(directory, f)) 
-            and f.lower().endswith('.png') 
-            and f not in analyzed_images]
+    deletes = PendingDeletes(directory, delete_batch_size)
+    prefetcher = ImagePrefetcher([os.path.join(directory, f) for f in files])
+    history = []
 
     index = 0
     print('qtd de imagens restantes', len(files))
 
-    while index < len(files):
-        filename = files[index]
-        filepath = os.path.join(directory, filename)
-        
-        # Lê a imagem usando OpenCV
-        img = cv2.imread(filepath)
-        
-        # Exibe a imagem
-        cv2.imshow('Image Viewer', img)
-        
-        # Espera por uma tecla ser pressionada
-        key = cv2.waitKey(0)
-        
-        if key == 27:  # Tecla ESC para sair
-            break
-        elif key == 100:  # Letra D (apaga a imagem)
-            os.remove(filepath)
-            print(f"Deleted {filename}")
-        else:  # Qualquer outra tecla (mantém a imagem)
-            print(f"Kept {filename}")
-        
-        # Marca a imagem como analisada
-        analyzed_images.append(filename)
-        
-        # Salva a lista de imagens analisadas no arquivo
-        with open(analyzed_file, 'w') as f:
-            for item in analyzed_images:
-                f.write("%s\n" % item)
-        
-        # Passa para a próxima imagem
-        index += 1
-    
-    cv2.destroyAllWindows()
-
-# Especifica o diretório contendo as imagens
-image_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/ImagensArvores/Individuais_Transparente'
-
-# Navega e gerencia as imagens
-browse_and_manage_images(image_directory)
\ No newline at end of file
+    try:
+        while index < len(files):
+            filename = files[index]
+
+            img = prefetcher.get(index)
+            if img is None:
+                print(f"Não foi possivel ler a imagem: {filename}")
+                index += 1
+                continue
+
+            # Exibe a imagem e espera por uma tecla
+            cv2.imshow('Image Viewer', img)
+            key = cv2.waitKey(0) & 0xFF
+
+            if key == 27:  # Tecla ESC para sair
+                break
+            elif key == ord('u'):  # Letra U (desfaz a última decisão)
+                if not history:
+                    continue
+                previous = history.pop()
+                if log.decisions.get(previous) == 'deleted':
+                    deletes.restore(previous)
+                log.undo(previous)
+                print(f"Undo {previous}")
+                index = files.index(previous)
+                continue
+            elif key == ord('d'):  # Letra D (apaga a imagem)
+                deletes.add(filename)
+                log.record(filename, 'deleted')
+                print(f"Deleted {filename}")
+            else:  # Qualquer outra tecla (mantém a imagem)
+                log.record(filename, 'kept')
+                print(f"Kept {filename}")
+
+            history.append(filename)
+            index += 1
+    finally:
+        deletes.flush()
+        if empty_trash:
+            deletes.empty_trash()
+        prefetcher.close()
+        log.close()
+        cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    # Especifica o diretório contendo as imagens
+    image_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/ImagensArvores/Individuais_Transparente'
+
+    # Navega e gerencia as imagens
+    browse_and_manage_images(image_directory)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+
+# Manifesto de build do dataset: para cada saida guarda o hash das entradas que a produziram
+# (fundo, arvores, semente, parametros). Numa nova execucao so e montado o que falta ou mudou.
+#
+# O manifesto e um log JSON Lines (uma linha por amostra concluida, gravada logo apos os arquivos),
+# entao uma execucao interrompida perde no maximo a amostra que estava sendo gravada e retoma dali.
+# No fim da execucao o log e compactado (uma linha por saida).
+# A semente da execucao tambem fica no manifesto (linha {"seed": ...}), para que uma execucao sem semente
+# informada reaproveite a anterior em vez de sortear outra e invalidar todas as saidas.
+MANIFEST_FILENAME = 'manifest.jsonl'
+FILE_HASHES_FILENAME = 'file_hashes.json'
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_inputs(**inputs):
+    # Hash estavel de um dicionario de entradas (chaves ordenadas, JSON)
+    encoded = json.dumps(inputs, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class FileHasher:
+    # Hash do conteudo dos arquivos de entrada, reaproveitado entre execucoes enquanto
+    # tamanho e data de modificacao nao mudarem (nao rele 200k arquivos a cada build)
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._cache = {}
+        self._dirty = False
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                self._cache = json.load(f)
+
+    def __call__(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+
+        cached = self._cache.get(path)
+        if cached is not None and cached[:2] == signature:
+            return cached[2]
+
+        file_hash = hash_file(path)
+        self._cache[path] = signature + [file_hash]
+        self._dirty = True
+        return file_hash
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._cache, f)
+        os.replace(tmp_path, self.cache_path)
+        self._dirty = False
+
+
+class BuildManifest:
+    # entries: {chave da saida: {'inputs': hash das entradas, 'files': [caminhos relativos ao destino]}}
+
+    def __init__(self, destination_directory):
+        self.destination_directory = destination_directory
+        self.path = os.path.join(destination_directory, MANIFEST_FILENAME)
+        self.hasher = FileHasher(os.path.join(destination_directory, FILE_HASHES_FILENAME))
+        self.entries = {}
+        self.seed = None
+        self._log = None
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Ultima linha cortada por uma interrupcao: descarta
+                        continue
+                    if 'seed' in record:
+                        self.seed = record['seed']
+                    elif record.get('removed'):
+                        self.entries.pop(record['key'], None)
+                    else:
+                        self.entries[record['key']] = {'inputs': record['inputs'], 'files': record['files']}
+
+    def is_fresh(self, key, inputs_hash):
+        # A saida esta em dia se foi gerada com as mesmas entradas e todos os arquivos ainda existem
+        entry = self.entries.get(key)
+        if entry is None or entry['inputs'] != inputs_hash:
+            return False
+        return all(os.path.exists(os.path.join(self.destination_directory, f)) for f in entry['files'])
+
+    def _append(self, record):
+        if self._log is None:
+            os.makedirs(self.destination_directory, exist_ok=True)
+            self._log = open(self.path, 'a')
+        self._log.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._log.flush()
+
+    def set_seed(self, seed):
+        # Guarda a semente usada nesta execucao (so grava se mudou)
+        if seed != self.seed:
+            self.seed = seed
+            self._append({'seed': seed})
+
+    def record(self, key, inputs_hash, files):
+        # Chamado depois que os arquivos da saida foram gravados
+        files = [os.path.relpath(f, self.destination_directory) for f in files]
+        self.entries[key] = {'inputs': inputs_hash, 'files': files}
+        self._append({'key': key, 'inputs': inputs_hash, 'files': files})
+
+    def discard(self, key):
+        # Apaga os arquivos de uma saida antiga (ex.: mudou de grupo ou o fundo foi removido)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for f in entry['files']:
+            path = os.path.join(self.destination_directory, f)
+            if os.path.exists(path):
+                os.remove(path)
+        self._append({'key': key, 'removed': True})
+
+    def close(self):
+        # Compacta o log (uma linha por saida) e salva o cache de hashes
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            if self.seed is not None:
+                f.write(json.dumps({'seed': self.seed}) + '\n')
+            for key, entry in sorted(self.entries.items()):
+                f.write(json.dumps({'key': key, 'inputs': entry['inputs'], 'files': entry['files']},
+                                   separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.path)
+        self.hasher.save()
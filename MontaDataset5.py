@@ -1,49 +1,100 @@
 import os
 import random
+import hashlib
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-import math 
 
-def get_random_images(tree_directory, num_images):
-
-    #Pega todas as imagens de arvores validas dentro da pasta. 
-    all_tree_images = [f for f in os.listdir(tree_directory)
-                             if os.path.isfile(os.path.join(tree_directory, f))
-                             and os.path.splitext(f)[1].lower() in ['.png']]
+from CacheSprites import DEFAULT_MAX_BYTES, SpriteCache
+from Composicao import blend_premultiplied
+from ShardsDataset import ShardWriter
+from ManifestoDataset import BuildManifest, hash_inputs
+from CatalogoArvores import TreeCatalog, ALPHA_THRESHOLD
+from IndiceDuplicatas import unique_images
+from CarregaImagens import load_image
+from Posicionamento import PlacementEngine
+from PiramidesSprites import build_pyramids, sample_scale
+from Aumentacao import AUGMENT_DEFAULTS, augment_batch
+from GravacaoAssincrona import AsyncWriter, WriterStats, encode_params
+
+# Cache compartilhado por todas as colagens: cada PNG de arvore e decodificado uma unica vez.
+# Cada processo do pool tem o seu (o orçamento é configurado por init_worker)
+sprite_cache = SpriteCache()
+
+# Parâmetros que mudam o resultado de uma composição. Entram no hash do manifesto: mudar qualquer um
+# deles (ou o COMPOSITION_VERSION, quando a lógica de colagem mudar) faz as saídas antigas serem remontadas
+NUM_TREES = 3
+COMPOSITION_VERSION = 2
+
+# Catálogos de árvores já montados, por (pasta, limiar do alfa): cada pasta é listada e lida uma única vez
+tree_catalogs = {}
+
+def get_tree_catalog(tree_directory, alpha_threshold=ALPHA_THRESHOLD):
+    key = (tree_directory, alpha_threshold)
+    if key not in tree_catalogs:
+        tree_catalogs[key] = TreeCatalog.build(tree_directory, alpha_threshold=alpha_threshold)
+    return tree_catalogs[key]
+
+def get_random_images(tree_directory, num_images, rng=random, mode='uniform'):
+
+    #Pega o catálogo de imagens de arvores validas da pasta (montado só na primeira chamada)
+    catalog = get_tree_catalog(tree_directory)
     
     #Confere se depois da selecao das imagens validas, a lista nao ficou vazia. Indicando que nenhuma imagem valida passou pelo criterio de selecao
-    if not all_tree_images:
+    if not len(catalog):
         print(f"Nenhuma imagem de arvore valida encontrada na {tree_directory}")
         return
     
-    #Embaralha as imagens de arvore
-    random.shuffle(all_tree_images)
-
-    selected_images = random.sample(all_tree_images, num_images)
+    #Sorteia as árvores em O(num_images), sem embaralhar a lista inteira
+    selected_images = [catalog.names[i] for i in catalog.sample(num_images, rng, mode)]
     return selected_images
 
-def paste_random_trees(base_image_path, random_tree_paths, output_image_path, labels_dir):
-    # Lê a imagem base (sempre em 3 canais para iniciar)
-    base_img = cv2.imread(base_image_path)
-    if base_img is None:
-        print(f"Não foi possivel ler a imagem: {base_image_path}")
-        return
-
-    # Converte para BGRA para facilitar a colagem com alfa
-    if base_img.shape[2] == 3:
-        base_img = cv2.cvtColor(base_img, cv2.COLOR_BGR2BGRA)
+def compose_trees(base_img, random_tree_paths, cache=None, rng=random, tree_boxes=None, placement=None,
+                  scales=None):
+    # Cola as árvores sobre base_img (BGR, alterada no próprio lugar) e devolve as caixas no formato YOLO
+    # como um array float32 (N, 5): class_id, center_x, center_y, width, height (normalizados de 0 a 1)
+    # tree_boxes: caixa justa do alfa de cada árvore (ver CatalogoArvores.py). O sprite é recortado nela
+    # antes de redimensionar e colar, então a caixa do label fica justa na árvore visível
+    # placement: None sorteia a posição livremente (como sempre foi); um dict com os parâmetros do
+    # PlacementEngine (ver Posicionamento.py, ex.: {'max_overlap': 0.3, 'max_occlusion': 0.5}) limita a
+    # sobreposição entre árvores e faz cada label cobrir só a parte da árvore que ficou visível
+    # scales: None usa a regra antiga (árvore maior que metade do fundo vira 1/7 da altura); um dict com a
+    # distribuição da escala (ver PiramidesSprites.sample_scale, ex.: {'distribution': 'loguniform',
+    # 'min': 0.05, 'max': 0.3}) sorteia a altura de cada árvore em relação à altura do fundo
+    if cache is None:
+        cache = sprite_cache
+    if tree_boxes is None:
+        tree_boxes = [None] * len(random_tree_paths)
 
     base_height, base_width = base_img.shape[:2]
-
-    # Cria o nome do arquivo de texto na subpasta labels
-    txt_filename = os.path.splitext(os.path.basename(output_image_path))[0] + '.txt'
-    txt_path = os.path.join(labels_dir, txt_filename)
-
-    with open(txt_path, 'w') as txt_file:
-        for tree_path in random_tree_paths:
-            # Lê a imagem da árvore com transparência (4 canais)
-            # cv2.IMREAD_UNCHANGED -> imagem será lida com todos os seus canais originais, inclusive o canal alfa (transparência), se ele existir.
-            tree = cv2.imread(tree_path, cv2.IMREAD_UNCHANGED)
+    boxes = []
+
+    engine = None
+    if placement is not None:
+        engine = PlacementEngine(base_height, base_width, **placement)
+        # Gerador numpy derivado do rng da composição (o sorteio continua reproduzível)
+        placement_rng = np.random.default_rng(rng.getrandbits(64))
+
+    for tree_path, crop_box in zip(random_tree_paths, tree_boxes):
+        if scales is not None and crop_box is not None:
+            # Escala sorteada (altura da árvore / altura do fundo), a partir do nível mais próximo da pirâmide
+            # do sprite (ver PiramidesSprites.py); a proporção vem da caixa do alfa, sem ler o PNG inteiro
+            new_height = base_height * sample_scale(scales, rng)
+            new_width = crop_box[2] / crop_box[3] * new_height
+            fit = min(1.0, base_width / new_width, base_height / new_height)
+            tree = cache.get_scaled(tree_path, (max(1, int(new_width * fit)), max(1, int(new_height * fit))),
+                                    crop_box)
+            if tree is None:
+                print(f"Imagem não conseguiu ser lida: {tree_path}")
+                continue
+            tree_height, tree_width = tree.shape[:2]
+        else:
+            # Pega a árvore do cache (4 canais, BGRA com alfa pré-multiplicado, já recortada)
+            # O PNG só é decodificado na primeira vez que a árvore é usada
+            tree = cache.get(tree_path, crop_box)
             if tree is None:
                 print(f"Imagem não conseguiu ser lida: {tree_path}")
                 continue
@@ -52,158 +103,610 @@ def paste_random_trees(base_image_path, random_tree_paths, output_image_path, la
 
             # Redimensiona se necessário (mantendo proporção)
             max_dim_ratio = 1/2 # Maximo tamanho da arvore, neste caso 50% do tamanho da imagem de fundo
-            
+
             if tree_height > base_height * max_dim_ratio or tree_width > base_width * max_dim_ratio:
                 scale_factor = 1/7
                 new_height = int(base_height * scale_factor)
                 new_width = int((tree_width / tree_height) * new_height)
 
-                tree = cv2.resize(tree, (new_width, new_height), interpolation=cv2.INTER_AREA)
+                # A versão redimensionada também fica no cache, com a chave (árvore, tamanho)
+                tree = cache.get_resized(tree_path, (new_width, new_height), crop_box)
                 tree_height, tree_width = tree.shape[:2]
 
-            x_offset = random.randint(0, base_width - tree_width)
-            y_offset = random.randint(0, base_height - tree_height)
-
-            # Extrai o canal alfa e cria máscara
-            # percorre a imagem e seleciona apenas o canal alfa e normaliza entre 0 e 1 (0 transparente e 1 opaco)
-            # depois cria o inverso do alfa (a opacidade)
-            alpha_channel = tree[:, :, 3] / 255.0
-            inverse_alpha = 1.0 - alpha_channel
-
-            # Aplica a colagem usando o canal alfa
-            for current_channel in range(0, 3): # Para cada canal de cor (BGR)
-                # Calcula a região de interesse na imagem base
-                roi = base_img[y_offset:y_offset+tree_height, x_offset:x_offset+tree_width, current_channel]
-
-                # Aplica a fórmula de blending: foreground * alpha + background * (1 - alpha)
-                base_img[y_offset:y_offset+tree_height, x_offset:x_offset+tree_width, current_channel] = (alpha_channel * tree[:, :, current_channel] + inverse_alpha * roi)
-
-            # Calcula as informações da árvore para o formato YOLO
-            # Coordenadas do centro normalizadas (0 a 1)
-            center_x = (x_offset + tree_width / 2) / base_width
-            center_y = (y_offset + tree_height / 2) / base_height
-            # Largura e altura normalizadas (0 a 1)
-            width = tree_width / base_width
-            height = tree_height / base_height
-
-            # Escreve as informações no arquivo de texto (formato YOLO: class_id center_x center_y width height)
-            # Assumindo class_id 0 para "tree"
-            txt_file.write(f"0 {center_x:.6f} {center_y:.6f} {width:.6f} {height:.6f}\n") # Usando .6f para 6 casas decimais
+        if engine is None:
+            x_offset = rng.randint(0, base_width - tree_width)
+            y_offset = rng.randint(0, base_height - tree_height)
+        else:
+            mask = engine.sprite_mask(tree)
+            position = engine.place(mask, placement_rng)
+            if position is None:
+                # Nenhuma posição sorteada respeitou os limites de sobreposição: a árvore fica de fora
+                continue
+            x_offset, y_offset = position
+            engine.commit(mask, x_offset, y_offset)
+
+        # Aplica a colagem usando o canal alfa, nos 3 canais de uma vez e na própria região de interesse
+        # fórmula com alfa pré-multiplicado: foreground + background * (1 - alpha)
+        blend_premultiplied(base_img, tree, x_offset, y_offset)
+        if engine is not None:
+            continue
+
+        # Calcula as informações da árvore para o formato YOLO
+        # Coordenadas do centro normalizadas (0 a 1)
+        center_x = (x_offset + tree_width / 2) / base_width
+        center_y = (y_offset + tree_height / 2) / base_height
+        # Largura e altura normalizadas (0 a 1)
+        width = tree_width / base_width
+        height = tree_height / base_height
+
+        # Assumindo class_id 0 para "tree"
+        boxes.append((0, center_x, center_y, width, height))
+
+    if engine is not None:
+        # Labels a partir dos pixels que continuaram visíveis depois de todas as colagens
+        boxes = [(0, (x + w / 2) / base_width, (y + h / 2) / base_height, w / base_width, h / base_height)
+                 for x, y, w, h in engine.visible_boxes()]
+
+    return base_img, np.array(boxes, dtype=np.float32).reshape(-1, 5)
+
+def format_yolo_labels(boxes):
+    # Uma linha por árvore (formato YOLO: class_id center_x center_y width height), com 6 casas decimais
+    return ''.join(f"{int(class_id)} {center_x:.6f} {center_y:.6f} {width:.6f} {height:.6f}\n"
+                   for class_id, center_x, center_y, width, height in boxes.tolist())
+
+def write_sample(image, boxes, output_image_path, labels_dir):
+    # Grava a imagem e o .txt de mesmo nome na subpasta labels
+    txt_filename = os.path.splitext(os.path.basename(output_image_path))[0] + '.txt'
+    txt_path = os.path.join(labels_dir, txt_filename)
 
-    # Remove o canal alfa antes de salvar (para salvar como JPEG)
-    final_img = cv2.cvtColor(base_img, cv2.COLOR_BGRA2BGR)
+    # Escreve as informações no arquivo de texto
+    with open(txt_path, 'w') as txt_file:
+        txt_file.write(format_yolo_labels(boxes))
 
     # Salva a imagem resultante
-    cv2.imwrite(output_image_path, final_img)
+    cv2.imwrite(output_image_path, image)
+    return True
+
+def augment_sample(image, boxes, seed, augment):
+    # Aumentação de uma única composição (lote de 1, ver Aumentacao.py); a semente é a da amostra
+    batch, batch_boxes = augment_batch(image[np.newaxis], [boxes], [seed], augment)
+    return batch[0], batch_boxes[0]
+
+def paste_random_trees(base_image_path, random_tree_paths, output_image_path, labels_dir, cache=None, rng=random,
+                       tree_boxes=None, placement=None, scales=None, augment=None, augment_seed=None):
+    # Monta e grava uma única composição. Para várias variações do mesmo fundo use render_background,
+    # que lê o fundo uma vez só
+    # Lê a imagem base (sempre em 3 canais, BGR). A colagem é feita direto no BGR, sem converter para BGRA
+    # O fundo é usado no tamanho original, então a leitura é sempre completa (ver CarregaImagens.py)
+    base_img = load_image(base_image_path)
+    if base_img is None:
+        print(f"Não foi possivel ler a imagem: {base_image_path}")
+        return False
+
+    base_img, boxes = compose_trees(base_img, random_tree_paths, cache, rng, tree_boxes, placement, scales)
+    if augment is not None:
+        base_img, boxes = augment_sample(base_img, boxes, augment_seed, augment)
+
+    return write_sample(base_img, boxes, output_image_path, labels_dir)
+
+def job_seed(seed, background_image, variation):
+    # Semente própria de cada composição, derivada só de (semente da execução, fundo, variação).
+    # Não depende da ordem de execução, então o resultado é o mesmo com 1 ou 64 processos.
+    # (hash() do Python muda a cada processo, por isso o sha256)
+    digest = hashlib.sha256(f"{seed}/{background_image}/{variation}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+def plan_trees(catalog, seed, background_image, variation, mode='uniform', job_index=0, num_trees=NUM_TREES):
+    # Escolhe as árvores de uma composição já no planejamento (antes de montar), com uma semente
+    # separada da semente de posicionamento. Assim o manifesto sabe de quais arquivos a saída depende.
+    # Devolve os caminhos e as caixas justas do alfa das árvores
+    rng = random.Random(job_seed(seed, f"trees/{background_image}", variation))
+    return catalog.sample_trees(num_trees, rng, mode, job_index, seed)
+
+# Buffer (lote, altura, largura, 3) reaproveitado entre os fundos montados por este processo
+variation_buffers = {}
+
+def variation_buffer(count, shape):
+    # Só aloca de novo quando o tamanho do fundo ou do lote muda
+    key = (count,) + tuple(shape)
+    if key not in variation_buffers:
+        variation_buffers.clear()
+        variation_buffers[key] = np.empty(key, dtype=np.uint8)
+    return variation_buffers[key]
+
+def render_background(background_path, variations, options, augment=None, batch_size=8):
+    # Monta todas as variações de um fundo, decodificando o fundo uma única vez.
+    # variations: lista de tuplas que começam com (caminhos das árvores, caixas das árvores, semente); o
+    # resto da tupla é do chamador e volta junto. Gera (variação, imagem, caixas) na ordem da lista
+    # As variações são montadas em lotes de batch_size: cada uma numa fatia de um buffer reaproveitado,
+    # copiada do fundo original, e com augment o lote inteiro é aumentado de uma vez (ver Aumentacao.py).
+    # A imagem é uma fatia do buffer: só vale até a próxima iteração (copie se precisar guardar)
+    base_img = load_image(background_path)
+    if base_img is None:
+        print(f"Não foi possivel ler a imagem: {background_path}")
+        for variation in variations:
+            yield variation, None, None
+        return
+
+    buffer = variation_buffer(min(batch_size, len(variations)), base_img.shape)
+    for start in range(0, len(variations), batch_size):
+        chunk = variations[start:start + batch_size]
+        batch = buffer[:len(chunk)]
+        boxes = []
+        for image, (random_tree_paths, tree_boxes, seed, *_) in zip(batch, chunk):
+            np.copyto(image, base_img)
+            boxes.append(compose_trees(image, random_tree_paths, rng=random.Random(seed), tree_boxes=tree_boxes,
+                                       **options)[1])
+        if augment is not None:
+            batch, boxes = augment_batch(batch, boxes, [variation[2] for variation in chunk], augment)
+
+        for variation, image, image_boxes in zip(chunk, batch, boxes):
+            yield variation, image, image_boxes
+
+# Gravador em segundo plano deste processo (criado por init_worker quando a saída é em arquivos): dura a
+# execução inteira, então a gravação de um fundo continua enquanto o próximo é montado
+async_writer = None
+# Barreira do fim da execução (ver drain_writer)
+drain_barrier = None
+
+def init_worker(sprite_cache_bytes=DEFAULT_MAX_BYTES, writer_options=None, barrier=None):
+    # Configura o estado de um processo do pool (ou do próprio processo, sem pool): o orçamento do
+    # cache de sprites vale para cada processo, então o total pode chegar a workers * sprite_cache_bytes
+    global async_writer, drain_barrier
+    sprite_cache.set_max_bytes(sprite_cache_bytes)
+    async_writer = AsyncWriter(**writer_options) if writer_options is not None else None
+    drain_barrier = barrier
+
+def render_job(job):
+    # Executa as composições de um fundo. Fica no nível do módulo para poder ser enviada aos processos do pool
+    # variations: (caminhos das árvores, caixas das árvores, semente, caminho da imagem, pasta dos labels)
+    # options: parâmetros extras de compose_trees (ex.: placement); augment: configuração da aumentação ou None
+    # Cada variação vai para o async_writer do processo (codificada e gravada em threads enquanto a próxima
+    # é montada) e o job não espera a gravação. Devolve (imagens que terminaram até agora, deste job ou de
+    # anteriores, como (caminho, gravou), None); as que faltarem saem em drain_writer
+    background_path, variations, options, augment, batch_size = job
+    failed = []
+    for variation, image, boxes in render_background(background_path, variations, options, augment, batch_size):
+        destination_path, labels_dir = variation[3], variation[4]
+        if image is None:
+            failed.append((destination_path, False))
+            continue
+        label_path = os.path.join(labels_dir, os.path.splitext(os.path.basename(destination_path))[0] + '.txt')
+        async_writer.submit(image, format_yolo_labels(boxes), destination_path, label_path)
+    return failed + async_writer.completed(), None
+
+def drain_writer(_=None):
+    # Fim da execução: espera a gravação do processo terminar e devolve (as imagens que faltavam, WriterStats).
+    # Com pool, uma chamada por processo: a barreira segura cada chamada até todas estarem rodando, então
+    # nenhum processo pega duas
+    global async_writer
+    if drain_barrier is not None:
+        drain_barrier.wait()
+    if async_writer is None:
+        return [], None
+    writer, async_writer = async_writer, None
+    return writer.close(), writer.stats
+
+def render_encoded(job):
+    # Versão para o formato em shards: monta no processo do pool e já devolve as imagens codificadas,
+    # para que só bytes compactos voltem ao processo principal (que grava os shards no grupo de cada variação)
+    # variations: (caminhos das árvores, caixas das árvores, semente, grupo). Devolve (bytes, caixas) ou None
+    # para cada variação
+    background_path, variations, options, augment, batch_size, image_ext, params = job
+    results = []
+    for variation, image, boxes in render_background(background_path, variations, options, augment, batch_size):
+        if image is None:
+            results.append(None)
+            continue
+        ok, encoded = cv2.imencode(image_ext, image, params)
+        if not ok:
+            print(f"Não foi possivel codificar a imagem de {background_path}")
+            results.append(None)
+            continue
+        results.append((encoded.tobytes(), boxes))
+    return results
+
+def render_batch(job):
+    # Versão em memória para iter_samples: devolve a lista de (imagem, caixas) das variações de um fundo,
+    # sem as que falharam (cópias, já que render_background reaproveita o buffer)
+    background_path, variations, options, augment, batch_size = job
+    return [(image.copy(), boxes)
+            for _, image, boxes in render_background(background_path, variations, options, augment, batch_size)
+            if image is not None]
+
+def iter_samples(source_directory, tree_directory, variations=3, seed=None, workers=0, prefetch=8,
+                 tree_sampling='uniform', num_trees=NUM_TREES, placement=None, scales=None, augment=None,
+                 batch_size=8, sprite_cache_bytes=DEFAULT_MAX_BYTES):
+    # Gera as composições sob demanda, sem passar pelo disco: cada item é (imagem BGR uint8, caixas float32 (N, 5)).
+    # Com a mesma semente, as amostras são as mesmas que process_images gravaria (mas sem a perda do JPEG).
+    # Cada fundo é lido uma vez e suas variações são montadas em lotes de batch_size (com augment, a
+    # aumentação roda no lote inteiro de uma vez; o resultado de cada amostra não depende do tamanho do lote).
+    # workers=0 monta tudo no próprio processo; com workers > 0, até `prefetch` fundos ficam
+    # sendo montados/prontos em segundo plano enquanto o consumidor (ex.: o treino) usa o atual
+    # sprite_cache_bytes: orçamento do cache de sprites de cada processo (ver init_worker)
+    all_background_images = list_background_images(source_directory)
+    if not all_background_images:
+        print(f"Nenhuma imagem de fundo valida encontrada na {source_directory}")
+        return
 
-def process_images(source_directory, tree_directory, destination_directory):
+    catalog = get_tree_catalog(tree_directory)
+    if not len(catalog):
+        print(f"Nenhuma imagem de arvore valida encontrada na {tree_directory}")
+        return
+    if scales is not None:
+        build_pyramids(catalog, workers=max(1, workers))
+
+    if seed is None:
+        seed = random.randrange(2**32)
+    options = {'placement': placement, 'scales': scales}
+
+    def plan_jobs():
+        for i, background_image in enumerate(all_background_images):
+            background_variations = []
+            for j in range(1, variations + 1):
+                random_tree_paths, tree_boxes = plan_trees(catalog, seed, background_image, j, tree_sampling,
+                                                           i * variations + j - 1, num_trees)
+                background_variations.append((random_tree_paths, tree_boxes, job_seed(seed, background_image, j)))
+            yield (os.path.join(source_directory, background_image), background_variations, options, augment,
+                   batch_size)
+
+    jobs = plan_jobs()
+
+    if workers <= 0:
+        init_worker(sprite_cache_bytes)
+        for job in jobs:
+            yield from render_batch(job)
+        return
 
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(sprite_cache_bytes,))
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(executor.submit(render_batch, job))
+            # Fila limitada: só envia mais trabalho quando o consumidor pega as amostras de um fundo
+            if len(pending) >= prefetch:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # Se o consumidor parar no meio, descarta o que ainda não começou a ser montado
+        executor.shutdown(cancel_futures=True)
+
+def run_jobs(jobs, workers=1, chunksize=None, render=render_job, collect=None, initargs=(), drain=False):
+    # Roda os jobs (um por fundo) em série (workers=1) ou espalhados num pool de processos.
+    # Os jobs são enviados em blocos (chunksize) para diluir o custo de comunicação entre processos.
+    # Os resultados chegam na ordem dos jobs; collect(job, resultado), se informado, é chamado no
+    # processo principal para cada um e devolve quantas imagens foram gravadas (sem collect, o resultado
+    # do job já é esse número). initargs vão para init_worker em cada processo (a barreira de drain_writer
+    # é acrescentada aqui); com drain=True, no fim cada processo roda drain_writer e o resultado vai para
+    # collect(None, resultado)
+    total = len(jobs)
+    report_every = max(1, total // 20)
+    done = 0
+    written = 0
+    start = time.perf_counter()
+
+    if workers > 1:
+        if chunksize is None:
+            chunksize = max(1, total // (workers * 4))
+        print(f"Usando {workers} processos (chunksize={chunksize})")
+        if drain:
+            initargs = (*initargs, multiprocessing.Barrier(workers))
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs)
+        results = executor.map(render, jobs, chunksize=chunksize)
+    else:
+        init_worker(*initargs)
+        executor = None
+        results = map(render, jobs)
+
+    try:
+        for job, result in zip(jobs, results):
+            done += 1
+            written += collect(job, result) if collect is not None else result
+            if done % report_every == 0 or done == total:
+                elapsed = time.perf_counter() - start
+                print(f"Montados {done}/{total} fundos ({written} imagens) -- {written / elapsed:.1f} imagens/s")
+
+        if drain:
+            # O que ainda estava sendo gravado em cada processo
+            if executor is not None:
+                drained = list(executor.map(drain_writer, range(workers)))
+            else:
+                drained = [drain_writer()]
+            for result in drained:
+                written += collect(None, result) if collect is not None else len(result[0])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    throughput = written / elapsed if elapsed > 0 else 0.0
+    print(f"Total: {written} imagens em {elapsed:.1f}s ({throughput:.1f} imagens/s)")
+    return written, throughput
+
+def list_background_images(source_directory):
     #Pega todas as imagens de fundo validas dentro da pasta. / Previne que arquivos como .DSSTORE sejam levados em consideracao e quebre o código
-    all_background_images = [f for f in os.listdir(source_directory)
-                             if os.path.isfile(os.path.join(source_directory, f))
-                             and os.path.splitext(f)[1].lower() in ['.jpg', '.jpeg', '.png']]
+    #Ordenadas, para que a lista de composições seja sempre a mesma
+    return [f for f in sorted(os.listdir(source_directory))
+            if os.path.isfile(os.path.join(source_directory, f))
+            and os.path.splitext(f)[1].lower() in ['.jpg', '.jpeg', '.png']]
+
+def plan_split(all_background_images, seed, variations=3, val_fraction=0.25, leakage_safe=True, duplicate_groups=None):
+    # Decide, antes de montar, se cada composição (fundo, variação) vai para 'train' ou 'val'.
+    # Cada grupo recebe uma posição por hash com semente, e os de menor posição vão para validação,
+    # na proporção exata de val_fraction (arredondada para baixo, como antes).
+    # Com leakage_safe=True o grupo é o fundo: todas as variações de um fundo caem no mesmo lado,
+    # então o mesmo fundo nunca aparece em treino e validação ao mesmo tempo.
+    # leakage_safe=False sorteia cada variação separadamente (um fundo pode ficar nos dois grupos)
+    # duplicate_groups: {fundo: representante} (ver IndiceDuplicatas.py); com leakage_safe=True fundos quase
+    # repetidos formam um único grupo, então também nunca ficam um em treino e outro em validação
+    if duplicate_groups is None:
+        duplicate_groups = {}
+    if leakage_safe:
+        groups = sorted({(duplicate_groups.get(background_image, background_image), None)
+                         for background_image in all_background_images})
+    else:
+        groups = [(background_image, j) for background_image in all_background_images
+                  for j in range(1, variations + 1)]
+
+    groups.sort(key=lambda group: job_seed(seed, f"split/{group[0]}", group[1]))
+    val_groups = set(groups[:int(len(groups) * val_fraction)])
+
+    split_plan = {}
+    for background_image in all_background_images:
+        for j in range(1, variations + 1):
+            if leakage_safe:
+                in_val = (duplicate_groups.get(background_image, background_image), None) in val_groups
+            else:
+                in_val = (background_image, j) in val_groups
+            split_plan[(background_image, j)] = 'val' if in_val else 'train'
+    return split_plan
+
+def output_name(background_image, variation):
+    #Separa o nome da imagem da sua extensao e monta o nome da variação (ex.: background_01_2.jpeg)
+    base_name = os.path.splitext(background_image)[0]
+    file_ext = os.path.splitext(background_image)[1].lower()
+    return f"{base_name}_{variation}{file_ext}"
+
+def process_images(source_directory, tree_directory, destination_directory, workers=1, seed=None, chunksize=None,
+                   val_fraction=0.25, leakage_safe=True, output_format='files', shard_size=1024, incremental=True,
+                   tree_sampling='uniform', tree_weights=None, alpha_threshold=ALPHA_THRESHOLD,
+                   duplicate_distance=None, dedupe_inputs=False, num_trees=NUM_TREES, placement=None, scales=None,
+                   augment=None, variations=3, batch_size=8, jpeg_quality=95, jpeg_optimize=False, fsync='never',
+                   writer_threads=2, max_pending=16, fsync_batch=64, sprite_cache_bytes=DEFAULT_MAX_BYTES,
+                   append_shards=False):
+    # output_format='files' grava um JPEG + um .txt por amostra (formato YOLO, como sempre).
+    # output_format='shards' grava train/ e val/ em shards binários (ver ShardsDataset.py), evitando
+    # centenas de milhares de arquivos pequenos no armazenamento compartilhado. Os shards não são incrementais:
+    # cada execução substitui os shards anteriores, a não ser com append_shards=True (acrescenta)
+    # incremental=True (só para 'files') usa o manifesto em destination_directory para montar apenas
+    # as saídas que faltam ou cujas entradas mudaram, e retoma uma execução interrompida
+    # tree_sampling: 'uniform', 'weighted' (com tree_weights, ver CatalogoArvores.py) ou 'cycle'
+    # (sem reposição ao longo da execução; mudar a lista de fundos muda as árvores de quase todas as saídas)
+    # alpha_threshold: alfa mínimo para um pixel contar na caixa justa da árvore (sprite recortado e label)
+    # duplicate_distance: se informado, fundos quase repetidos (hash perceptual, ver IndiceDuplicatas.py) caem
+    # sempre no mesmo grupo treino/validação; com dedupe_inputs=True só o primeiro de cada grupo de fundos
+    # e de árvores quase repetidas é usado
+    # num_trees: árvores por composição; placement: controle de sobreposição; scales: distribuição da escala
+    # das árvores, coladas a partir de pirâmides montadas uma vez em disco (ver compose_trees)
+    # augment: dict com a configuração da aumentação (ver Aumentacao.py; {} usa AUGMENT_DEFAULTS), None desliga
+    # variations: composições por fundo. Cada fundo é decodificado uma única vez e suas variações são montadas
+    # em lotes de batch_size num buffer reaproveitado (ver render_background)
+    # jpeg_quality/jpeg_optimize: parâmetros do JPEG. Só para 'files': fsync ('never', 'batch' ou 'each'),
+    # fsync_batch, writer_threads (threads de codificação e de gravação por processo) e max_pending (imagens em
+    # andamento por processo) configuram a gravação em segundo plano, um gravador por processo durante a
+    # execução inteira (ver GravacaoAssincrona.py)
+    # sprite_cache_bytes: orçamento do cache de sprites de CADA processo (com workers processos, o total
+    # pode chegar a workers * sprite_cache_bytes)
+    if dedupe_inputs and duplicate_distance is None:
+        raise ValueError("dedupe_inputs=True precisa de duplicate_distance")
+    if output_format not in ('files', 'shards'):
+        raise ValueError(f"output_format inválido: {output_format}")
+
+    all_background_images = list_background_images(source_directory)
     
     #Confere se depois da selecao das imagens validas, a lista nao ficou vazia. Indicando que nenhuma imagem valida passou pelo criterio de selecao
     if not all_background_images:
         print(f"Nenhuma imagem de fundo valida encontrada na {source_directory}")
         return
 
+    duplicate_groups = None
+    if duplicate_distance is not None:
+        kept, duplicate_groups = unique_images(source_directory, all_background_images, duplicate_distance, workers)
+        print(f"{len(all_background_images) - len(kept)} fundos quase repetidos")
+        if dedupe_inputs:
+            all_background_images = kept
+
+    #Catálogo das árvores: a pasta é listada e lida uma vez por execução, não uma vez por composição
+    catalog = get_tree_catalog(tree_directory, alpha_threshold)
+    if not len(catalog):
+        print(f"Nenhuma imagem de arvore valida encontrada na {tree_directory}")
+        return
+    if tree_weights is not None:
+        # Cópia com os pesos desta execução (o catálogo guardado em tree_catalogs continua uniforme)
+        catalog = TreeCatalog(catalog.tree_directory, catalog.names, catalog.sizes, catalog.alpha_boxes, tree_weights)
+    if dedupe_inputs:
+        # Catálogo só com uma árvore de cada grupo de quase repetidas (os pesos vão junto)
+        kept, _ = unique_images(tree_directory, catalog.names, duplicate_distance, workers)
+        kept = set(kept)
+        keep = [i for i, name in enumerate(catalog.names) if name in kept]
+        print(f"{len(catalog) - len(keep)} árvores quase repetidas ignoradas")
+        catalog = TreeCatalog(catalog.tree_directory, [catalog.names[i] for i in keep], catalog.sizes[keep],
+                              catalog.alpha_boxes[keep], catalog.weights[keep])
+
     # Define as pastas de saída
-    train_images_dir = os.path.join(destination_directory, 'train', 'images')
-    train_labels_dir = os.path.join(destination_directory, 'train', 'labels')
-    val_images_dir = os.path.join(destination_directory, 'val', 'images')
-    val_labels_dir = os.path.join(destination_directory, 'val', 'labels')
-
-    os.makedirs(train_images_dir, exist_ok=True)
-    os.makedirs(train_labels_dir, exist_ok=True)
-    os.makedirs(val_images_dir, exist_ok=True)
-    os.makedirs(val_labels_dir, exist_ok=True)
-
-    # --- Imagens de Treinamento ---
-    print("\n--- Montando Imagens de Treinamento ---")
+    output_dirs = {}
+    for split in ('train', 'val'):
+        images_dir = os.path.join(destination_directory, split, 'images')
+        labels_dir = os.path.join(destination_directory, split, 'labels')
+        if output_format == 'files':
+            os.makedirs(images_dir, exist_ok=True)
+            os.makedirs(labels_dir, exist_ok=True)
+        output_dirs[split] = (images_dir, labels_dir)
+
+    manifest = None
+    if incremental and output_format == 'files':
+        manifest = BuildManifest(destination_directory)
+
+    # Sem semente informada, reaproveita a do manifesto (builds incrementais precisam da mesma semente entre
+    # as execuções) ou, na primeira execução, sorteia uma e mostra, para que a execução possa ser repetida
+    if seed is None and manifest is not None and manifest.seed is not None:
+        seed = manifest.seed
+        print(f"Semente da execução (do manifesto): {seed}")
+    else:
+        if seed is None:
+            seed = random.randrange(2**32)
+        print(f"Semente da execução: {seed}")
+    if manifest is not None:
+        manifest.set_seed(seed)
+
+    #Separa as composições em dois grupos: treinamento e validação (por padrão ~75/25%), antes de montar.
+    #Cada imagem já é gravada direto na pasta final, sem a etapa de mover arquivos depois
+    split_plan = plan_split(all_background_images, seed, variations, val_fraction, leakage_safe, duplicate_groups)
+    num_val_images = sum(1 for split in split_plan.values() if split == 'val')
+
+    print(f"Total images planned: {len(split_plan)}")
+    print(f"Training images: {len(split_plan) - num_val_images}")
+    print(f"Validation images: {num_val_images}")
+
+    params = {'num_trees': num_trees, 'version': COMPOSITION_VERSION, 'alpha_threshold': alpha_threshold}
+    if placement is not None:
+        params['placement'] = placement
+    if scales is not None:
+        params['scales'] = scales
+        build_pyramids(catalog, workers=workers)
+    if (jpeg_quality, jpeg_optimize) != (95, False):
+        params['jpeg'] = {'quality': jpeg_quality, 'optimize': jpeg_optimize}
+    if augment is not None:
+        # Configuração completa no manifesto: mudar um padrão também remonta as saídas
+        augment = dict(AUGMENT_DEFAULTS, **augment)
+        params['augment'] = augment
+    options = {'placement': placement, 'scales': scales}
+    writer_options = {'encode_workers': writer_threads, 'write_workers': writer_threads, 'max_pending': max_pending,
+                      'jpeg_quality': jpeg_quality, 'jpeg_optimize': jpeg_optimize, 'fsync': fsync,
+                      'fsync_batch': fsync_batch}
+
+    # --- Imagens de Treinamento e Validação ---
+    print("\n--- Montando Imagens ---")
+    # Um job por fundo, com as variações que precisam ser montadas
+    jobs = []
+    input_hashes = {}
+    num_planned = 0
     for i, background_image in enumerate(all_background_images):
-        print(f"Montando imagem: {background_image} -- {i+1}/{len(all_background_images)}")
-
         #Pega o caminho da imagem de fundo atual, para saber referenciala e pega-la no sistema de arquivo
         background_path = os.path.join(source_directory, background_image)
+        background_variations = []
 
-        #Separa o nome da imagem da sua extensao
-        base_name = os.path.splitext(background_image)[0]
-        file_ext = os.path.splitext(background_image)[1].lower()
-        
-        # Cria 3 variações para cada imagem de fundo
-        for j in range(1, 4):
-            output_filename = f"{base_name}_{j}{file_ext}"
-            destination_path = os.path.join(train_images_dir, output_filename)
+        # Cria as variações de cada imagem de fundo
+        for j in range(1, variations + 1):
+            split = split_plan[(background_image, j)]
+            random_tree_paths, tree_boxes = plan_trees(catalog, seed, background_image, j, tree_sampling,
+                                                       i * variations + j - 1, num_trees)
+            sample_seed = job_seed(seed, background_image, j)
 
-            random_trees = get_random_images(tree_directory, 3)
-            random_tree_paths = [os.path.join(tree_directory, img) for img in random_trees]
+            if output_format == 'shards':
+                background_variations.append((random_tree_paths, tree_boxes, sample_seed, split))
+                continue
 
-            paste_random_trees(background_path, random_tree_paths, destination_path, train_labels_dir)
-    
-    #Pega todas as imagens validas geradas acima. / Previne que arquivos como .DSSTORE sejam levados em consideracao e quebre o código
-    print("train_images_dir:  "+train_images_dir)
-    all_training_images = [f for f in os.listdir(train_images_dir)
-                             if os.path.isfile(os.path.join(train_images_dir, f))
-                             and os.path.splitext(f)[1].lower() in ['.jpg', '.jpeg', '.png']]
-    
-    #Confere se depois da selecao das imagens validas, a lista nao ficou vazia. Indicando que nenhuma imagem valida passou pelo criterio de selecao
-    if not all_training_images:
-        print(f"Nenhuma imagem de fundo valida encontrada na {train_images_dir}")
+            output_filename = output_name(background_image, j)
+            images_dir, labels_dir = output_dirs[split]
+            destination_path = os.path.join(images_dir, output_filename)
+
+            if manifest is not None:
+                # Hash de tudo que determina esta saída; se bater com o manifesto, não precisa montar de novo
+                inputs_hash = hash_inputs(background=manifest.hasher(background_path),
+                                          trees=[manifest.hasher(path) for path in random_tree_paths],
+                                          seed=sample_seed, split=split, params=params)
+                if manifest.is_fresh(output_filename, inputs_hash):
+                    continue
+                # Saída antiga com outras entradas (ou em outro grupo): apaga antes de montar de novo
+                manifest.discard(output_filename)
+                input_hashes[destination_path] = (output_filename, inputs_hash, labels_dir)
+
+            background_variations.append((random_tree_paths, tree_boxes, sample_seed, destination_path, labels_dir))
+
+        if not background_variations:
+            continue
+        num_planned += len(background_variations)
+        if output_format == 'shards':
+            jobs.append((background_path, background_variations, options, augment, batch_size, '.jpg',
+                         encode_params('.jpg', jpeg_quality, jpeg_optimize)))
+        else:
+            jobs.append((background_path, background_variations, options, augment, batch_size))
+
+    if output_format == 'files':
+        if manifest is not None:
+            # Remove as saídas de fundos que não existem mais
+            planned = {output_name(background_image, j) for background_image, j in split_plan}
+            for key in [key for key in manifest.entries if key not in planned]:
+                manifest.discard(key)
+
+            print(f"{len(split_plan) - num_planned} imagens já em dia, {num_planned} para montar")
+
+        # Tempos e profundidade das filas de codificação/gravação, somados de todos os processos
+        writer_stats = WriterStats()
+
+        def collect(job, result):
+            # result: (imagens que terminaram, como (caminho, gravou), e WriterStats no fim de cada processo).
+            # Não são necessariamente do job que acabou de chegar: saem dos Futures do gravador do processo
+            completions, job_stats = result
+            if job_stats is not None:
+                writer_stats.merge(job_stats)
+            written = 0
+            for destination_path, ok in completions:
+                if not ok:
+                    continue
+                written += 1
+                # Só entra no manifesto depois que a imagem e o label foram gravados
+                if manifest is not None:
+                    output_filename, inputs_hash, labels_dir = input_hashes[destination_path]
+                    label_path = os.path.join(labels_dir, os.path.splitext(output_filename)[0] + '.txt')
+                    manifest.record(output_filename, inputs_hash, [destination_path, label_path])
+            return written
+
+        try:
+            run_jobs(jobs, workers, chunksize, render_job, collect, (sprite_cache_bytes, writer_options), drain=True)
+        finally:
+            if manifest is not None:
+                manifest.close()
+        print(writer_stats.report())
         return
-    
-    #Embaralha as imagens 
-    random.shuffle(all_training_images)
- 
-    #Separa as imagens em dois grupos: treinamento e validação, na proporção 75/25%
-    num_val_images = math.floor(len(all_training_images) * 0.25)
-
-    split_point = len(all_training_images) - num_val_images
-
-    train_images = all_training_images[:split_point]
-    val_images = all_training_images[split_point:]
-
-    print(f"Total background images found: {len(all_training_images)}")
-    print(f"Training background images: {len(train_images)}")
-    print(f"Validation background images: {len(val_images)}")
-
-
-    print("\n--- Separando as Imagens de Validação ---")
-    for i, val_image in enumerate(val_images):
-        print(f"Movendo imagem: {val_image} -- {i+1}/{len(val_images)}")
-
-        # --- Caminho do arquivo de imagem na pasta de treino (origem) ---
-        source_image_path = os.path.join(train_images_dir, val_image)
-        print("Origem imagem: " + source_image_path)
-
-        # --- Caminho do arquivo de imagem na pasta de validação (destino) ---
-        destination_image_path = os.path.join(val_images_dir, val_image)
-        print("Destino imagem: " + destination_image_path)
 
-        # --- Caminho do arquivo de label correspondente na pasta de treino (origem) ---
-        label_filename = os.path.splitext(val_image)[0] + '.txt'
-        source_label_path = os.path.join(train_labels_dir, label_filename)
-        print("Origem label: " + source_label_path)
+    # Shards: os processos do pool montam e codificam; o processo principal só anexa os bytes
+    # nos shards do grupo certo, na ordem dos jobs (mesma saída com qualquer número de processos)
+    # Sem append_shards, cada grupo é montado numa pasta temporária que só substitui a antiga no fim
+    writers = {split: ShardWriter(os.path.join(destination_directory, split), shard_size, append=append_shards)
+               for split in ('train', 'val')}
 
-        # --- Caminho do arquivo de label correspondente na pasta de validação (destino) ---
-        destination_label_path = os.path.join(val_labels_dir, label_filename)
-        print("Destino label: " + destination_label_path)
-
-        # Originalmente, os.rename() serve para renomear arquivos ou diretórios. 
-        # No entanto, se o novo caminho especificado (dst) incluir um diretório diferente do original (src), 
-        # o efeito é que o arquivo (ou diretório) é movido para esse novo local.
-
-        # Mover a imagem usando os.rename()
-        os.rename(source_image_path, destination_image_path)
-        # Mover o label correspondente usando os.rename()
-        os.rename(source_label_path, destination_label_path)
-
-
-
-# Diretórios
-source_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/FittedBackgrounds'
-tree_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente'
-destination_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/TreeDataset'
-
-# Chame a função principal para iniciar o processo
-process_images(source_directory, tree_directory, destination_directory)
\ No newline at end of file
+    def collect(job, results):
+        written = 0
+        for variation, result in zip(job[1], results):
+            if result is None:
+                continue
+            encoded, boxes = result
+            writers[variation[3]].add(boxes, encoded=encoded)
+            written += 1
+        return written
+
+    try:
+        run_jobs(jobs, workers, chunksize, render_encoded, collect, (sprite_cache_bytes,))
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+
+
+
+# O bloco abaixo só roda quando o script é executado diretamente.
+# Necessário para o pool de processos: no macOS/Windows cada processo filho importa este módulo de novo
+if __name__ == '__main__':
+    # Diretórios
+    source_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/FittedBackgrounds'
+    tree_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente'
+    destination_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/TreeDataset'
+
+    # Chame a função principal para iniciar o processo (um processo por núcleo)
+    process_images(source_directory, tree_directory, destination_directory, workers=os.cpu_count())
@@ -1,77 +1,185 @@
 import os
 import cv2
 import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-def draw_bounding_boxes(image_dir, output_dir):
+# Cores diferentes para cada árvore (no formato BGR)
+colors = [
+    (0, 0, 255),    # Vermelho
+    (0, 255, 0),    # Verde
+    (255, 0, 0),    # Azul
+    (0, 255, 255),  # Amarelo
+    (255, 0, 255),  # Magenta
+    (255, 255, 0)   # Ciano
+]
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def parse_label_line(line):
+    # Aceita o formato YOLO gravado pelo MontaDataset5 ("class_id center_x center_y width height", valores
+    # normalizados de 0 a 1) e o formato antigo em pixels ("center_x center_y width height", inteiros).
+    # Devolve (class_id, center_x, center_y, width, height, normalizado) ou None para linha vazia
+    values = line.split()
+    if not values:
+        return None
+    if len(values) == 5:
+        class_id, center_x, center_y, width, height = values
+        return int(float(class_id)), float(center_x), float(center_y), float(width), float(height), True
+    if len(values) == 4:
+        center_x, center_y, width, height = map(int, values)
+        return 0, center_x, center_y, width, height, False
+    raise ValueError(f"esperadas 4 ou 5 colunas, encontradas {len(values)}")
+
+def find_label_path(image_path, labels_dir=None):
+    # Com labels_dir, o .txt de mesmo nome nessa pasta. Sem, procura no layout do YOLO
+    # (.../images/x.jpg -> .../labels/x.txt) e depois ao lado da imagem
+    txt_filename = os.path.splitext(os.path.basename(image_path))[0] + '.txt'
+    if labels_dir is not None:
+        return os.path.join(labels_dir, txt_filename)
+    image_dir = os.path.dirname(image_path)
+    yolo_path = os.path.join(os.path.dirname(image_dir), 'labels', txt_filename)
+    if os.path.basename(image_dir) == 'images' and os.path.exists(yolo_path):
+        return yolo_path
+    return os.path.join(image_dir, txt_filename)
+
+def draw_boxes(image, annotations, txt_path=''):
+    # Desenha os retângulos de cada árvore na imagem (no próprio lugar). Devolve quantos foram desenhados
+    image_height, image_width = image.shape[:2]
+    drawn = 0
+    for i, annotation in enumerate(annotations):
+        try:
+            parsed = parse_label_line(annotation)
+        except ValueError:
+            print(f"Formato inválido no arquivo {txt_path}, linha {i+1}")
+            continue
+        if parsed is None:
+            continue
+        class_id, center_x, center_y, width, height, normalized = parsed
+
+        # Calcula as coordenadas do retângulo (em pixels)
+        if normalized:
+            center_x, width = center_x * image_width, width * image_width
+            center_y, height = center_y * image_height, height * image_height
+        x1 = int(round(center_x - width / 2))
+        y1 = int(round(center_y - height / 2))
+        x2 = int(round(center_x + width / 2))
+        y2 = int(round(center_y + height / 2))
+
+        # Escolhe uma cor (cíclica se tiver mais árvores que cores)
+        color = colors[drawn % len(colors)]
+
+        # Desenha o retângulo
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+
+        # Adiciona um texto com o número da árvore
+        cv2.putText(image, f"Tree {drawn+1}", (x1, max(y1-10, 10)),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        drawn += 1
+    return drawn
+
+def render_overlay(job):
+    # Roda nos processos do pool. Com output_path grava a imagem com os retângulos e devolve
+    # (nome, quantidade); com tile_size devolve (nome, quantidade, miniatura) para o mosaico
+    image_path, labels_dir, output_path, tile_size = job
+    filename = os.path.basename(image_path)
+
+    # Verifica se o arquivo de anotação existe
+    txt_path = find_label_path(image_path, labels_dir)
+    if not os.path.exists(txt_path):
+        print(f"Arquivo de anotação não encontrado para {filename}")
+        return filename, None, None
+
+    # Carrega a imagem
+    image = cv2.imread(image_path)
+    if image is None:
+        print(f"Não foi possível carregar a imagem {filename}")
+        return filename, None, None
+
+    # Lê as anotações do arquivo txt
+    with open(txt_path, 'r') as f:
+        annotations = f.readlines()
+    drawn = draw_boxes(image, annotations, txt_path)
+
+    if tile_size is None:
+        # Salva a imagem com os retângulos
+        cv2.imwrite(output_path, image)
+        return filename, drawn, None
+
+    # Miniatura (mantendo a proporção) com o nome do arquivo, para o mosaico
+    tile_width, tile_height = tile_size
+    scale = min(tile_width / image.shape[1], tile_height / image.shape[0])
+    thumbnail = cv2.resize(image, (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    tile = np.zeros((tile_height, tile_width, 3), dtype=np.uint8)
+    tile[:thumbnail.shape[0], :thumbnail.shape[1]] = thumbnail
+    cv2.putText(tile, filename, (4, tile_height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    return filename, drawn, tile
+
+def draw_bounding_boxes(image_dir, output_dir, labels_dir=None, sample=None, seed=None, workers=1,
+                        mosaic=None, tile_size=(320, 240), chunksize=None):
+    # labels_dir: pasta dos .txt (None = layout do YOLO images/ -> labels/, ou ao lado da imagem)
+    # sample: desenha só N imagens sorteadas (com seed, o sorteio é reproduzível); None = todas
+    # workers: número de processos
+    # mosaic=(colunas, linhas): em vez de um JPEG por imagem, grava folhas de contato (contact_000.jpg, ...)
+    # com colunas x linhas miniaturas de tile_size cada
     # Verifica se o diretório de destino existe, se não, cria-o
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # Cores diferentes para cada árvore (no formato BGR)
-    colors = [
-        (0, 0, 255),    # Vermelho
-        (0, 255, 0),    # Verde
-        (255, 0, 0),    # Azul
-        (0, 255, 255),  # Amarelo
-        (255, 0, 255),  # Magenta
-        (255, 255, 0)   # Ciano
-    ]
-    
+    os.makedirs(output_dir, exist_ok=True)
+
     # Percorre todas as imagens no diretório
-    for filename in os.listdir(image_dir):
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-            # Caminhos dos arquivos
-            image_path = os.path.join(image_dir, filename)
-            txt_path = os.path.join(image_dir, os.path.splitext(filename)[0] + '.txt')
-            
-            # Verifica se o arquivo de anotação existe
-            if not os.path.exists(txt_path):
-                print(f"Arquivo de anotação não encontrado para {filename}")
+    filenames = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if sample is not None and sample < len(filenames):
+        filenames = sorted(random.Random(seed).sample(filenames, sample))
+
+    jobs = [(os.path.join(image_dir, filename), labels_dir, os.path.join(output_dir, filename),
+             tuple(tile_size) if mosaic is not None else None)
+            for filename in filenames]
+
+    if workers > 1 and jobs:
+        if chunksize is None:
+            chunksize = max(1, len(jobs) // (workers * 4))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(render_overlay, jobs, chunksize=chunksize)
+    else:
+        executor = None
+        results = map(render_overlay, jobs)
+
+    tiles = []
+    sheets = 0
+
+    def write_sheet(tiles, index):
+        columns, rows = mosaic
+        blank = np.zeros_like(tiles[0])
+        tiles = tiles + [blank] * (columns * rows - len(tiles))
+        sheet = np.vstack([np.hstack(tiles[r * columns:(r + 1) * columns]) for r in range(rows)])
+        cv2.imwrite(os.path.join(output_dir, f"contact_{index:03d}.jpg"), sheet)
+
+    try:
+        for filename, drawn, tile in results:
+            if drawn is None:
                 continue
-            
-            # Carrega a imagem
-            image = cv2.imread(image_path)
-            if image is None:
-                print(f"Não foi possível carregar a imagem {filename}")
+            if mosaic is None:
+                print(f"Processada {filename} com {drawn} árvores marcadas")
                 continue
-            
-            # Lê as anotações do arquivo txt
-            with open(txt_path, 'r') as f:
-                annotations = f.readlines()
-            
-            # Desenha os retângulos para cada árvore
-            for i, annotation in enumerate(annotations):
-                try:
-                    center_x, center_y, width, height = map(int, annotation.strip().split())
-                    
-                    # Calcula as coordenadas do retângulo
-                    x1 = center_x - width // 2
-                    y1 = center_y - height // 2
-                    x2 = center_x + width // 2
-                    y2 = center_y + height // 2
-                    
-                    # Escolhe uma cor (cíclica se tiver mais árvores que cores)
-                    color = colors[i % len(colors)]
-                    
-                    # Desenha o retângulo
-                    cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
-                    
-                    # Adiciona um texto com o número da árvore
-                    cv2.putText(image, f"Tree {i+1}", (x1, y1-10), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                
-                except ValueError:
-                    print(f"Formato inválido no arquivo {txt_path}, linha {i+1}")
-                    continue
-            
-            # Salva a imagem com os retângulos
-            output_path = os.path.join(output_dir, filename)
-            cv2.imwrite(output_path, image)
-            print(f"Processada {filename} com {len(annotations)} árvores marcadas")
-
-# Diretórios de entrada e saída
-image_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/Dataset'
-output_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/Dataset_With_Boxes'
-
-# Executa a função
-draw_bounding_boxes(image_directory, output_directory)
\ No newline at end of file
+            tiles.append(tile)
+            if len(tiles) == mosaic[0] * mosaic[1]:
+                write_sheet(tiles, sheets)
+                sheets += 1
+                tiles = []
+        if tiles:
+            write_sheet(tiles, sheets)
+            sheets += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if mosaic is not None:
+        print(f"{len(jobs)} imagens em {sheets} folhas de contato em {output_dir}")
+
+if __name__ == '__main__':
+    # Diretórios de entrada e saída
+    image_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/Dataset'
+    output_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/Dataset_With_Boxes'
+
+    # Executa a função
+    draw_bounding_boxes(image_directory, output_directory, workers=os.cpu_count())
@@ -30,42 +30,98 @@
 # convert_images_to_png(source_directory, destination_directory)
 
 import os
+import sys
 import cv2
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Leitura compartilhada (CarregaImagens.py, na pasta do projeto)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CarregaImagens import load_image, sniff_format
+
+# Como os arquivos que já estão no formato certo chegam ao destino (sem decodificar nem recodificar):
+#   'copy'     -> cópia dos bytes (shutil.copy2)
+#   'hardlink' -> hardlink (não ocupa espaço; se não der, por ex. em outro disco, copia)
+#   'move'     -> renomeia/move o arquivo de origem
+TRANSFER_METHODS = ('copy', 'hardlink', 'move')
+
+def transfer_file(source_path, destination_path, method):
+    if method == 'move':
+        try:
+            os.replace(source_path, destination_path)
+        except OSError:
+            # Outro disco: shutil.move copia e apaga
+            shutil.move(source_path, destination_path)
+    elif method == 'hardlink':
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        try:
+            os.link(source_path, destination_path)
+        except OSError:
+            shutil.copy2(source_path, destination_path)
+    else:
+        shutil.copy2(source_path, destination_path)
+
+def normalize_image(job):
+    # Roda nas threads do pool. O formato é decidido pelo conteúdo (bytes mágicos), não pela extensão:
+    # um .jpg que já é JPEG só troca de nome; só arquivos com outro conteúdo (ex.: PNG com extensão .jpg)
+    # são decodificados e recodificados. Devolve (nome, ação)
+    source_path, destination_path, method, jpeg_quality = job
+    filename = os.path.basename(source_path)
+
+    if os.path.exists(destination_path) and os.path.getmtime(destination_path) >= os.path.getmtime(source_path) \
+            and os.path.getsize(destination_path) > 0:
+        return filename, 'skipped'
+
+    with open(source_path, 'rb') as f:
+        image_format = sniff_format(f.read(8))
+
+    if image_format == 'jpeg':
+        transfer_file(source_path, destination_path, method)
+        return filename, method
+
+    img = load_image(source_path)
+    if img is None:
+        return filename, 'failed'
+    if not cv2.imwrite(destination_path, img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]):
+        return filename, 'failed'
+    if method == 'move':
+        os.remove(source_path)
+    return filename, 're-encoded'
+
+def convert_jpg_to_jpeg(source_directory, destination_directory, method='copy', workers=8, jpeg_quality=95):
+    # Normaliza .jpg/.jpeg da pasta de origem para .jpeg no destino, em um pool de threads
+    # (o trabalho é quase só leitura/escrita de arquivo). method: ver TRANSFER_METHODS
+    if method not in TRANSFER_METHODS:
+        raise ValueError(f"method inválido: {method} (use um de {TRANSFER_METHODS})")
 
-def convert_jpg_to_jpeg(source_directory, destination_directory):
     # Verifica se o diretório de destino existe, se não, cria-o
-    if not os.path.exists(destination_directory):
-        os.makedirs(destination_directory)
-    
-    # Itera sobre todos os arquivos no diretório de origem
-    for filename in os.listdir(source_directory):
-        # Obtém a extensão do arquivo
-        file_ext = os.path.splitext(filename)[1].lower()
-        
+    os.makedirs(destination_directory, exist_ok=True)
+
+    jobs = []
+    for filename in sorted(os.listdir(source_directory)):
         # Verifica se o arquivo é JPG ou JPEG
-        if file_ext in ['.jpg', '.jpeg']:
-            # Se for JPG, converte para JPEG
-            if file_ext == '.jpg':
-                # Lê a imagem usando OpenCV
-                img = cv2.imread(os.path.join(source_directory, filename))
-                
-                # Converte a imagem para JPEG
-                jpeg_filename = os.path.splitext(filename)[0] + '.jpeg'
-                cv2.imwrite(os.path.join(destination_directory, jpeg_filename), img, [cv2.IMWRITE_JPEG_QUALITY, 95])
-                
-                print(f"Converted {filename} to {jpeg_filename}")
-            # Se já for JPEG, apenas copia para o diretório de destino
-            elif file_ext == '.jpeg':
-                shutil.copy2(
-                    os.path.join(source_directory, filename),
-                    os.path.join(destination_directory, filename)
-                )
-                print(f"Copied {filename} to destination directory")
-
-# Especifica os diretórios de origem e destino
-source_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/Backgrounds'
-destination_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/01Backgrounds'
-
-# Executa a conversão
-convert_jpg_to_jpeg(source_directory, destination_directory)
+        if os.path.splitext(filename)[1].lower() in ['.jpg', '.jpeg']:
+            jpeg_filename = os.path.splitext(filename)[0] + '.jpeg'
+            jobs.append((os.path.join(source_directory, filename), os.path.join(destination_directory, jpeg_filename),
+                         method, jpeg_quality))
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for filename, action in executor.map(normalize_image, jobs):
+            counts[action] = counts.get(action, 0) + 1
+            if action == 'failed':
+                print(f"Não foi possivel ler a imagem: {filename}")
+            elif action != 'skipped':
+                print(f"{action}: {filename}")
+
+    print(', '.join(f"{count} {action}" for action, count in sorted(counts.items())))
+    return counts
+
+if __name__ == '__main__':
+    # Especifica os diretórios de origem e destino
+    source_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/Backgrounds'
+    destination_directory = '/Users/iagocampista/Documents/Projects/Image Neural Network Train/01Backgrounds'
+
+    # Executa a conversão
+    convert_jpg_to_jpeg(source_directory, destination_directory)
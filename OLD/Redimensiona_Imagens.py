@@ -1,47 +1,242 @@
 import os
+import sys
+import json
+import math
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 
-def resize_images(source_dir, dest_dir, target_size=(1024, 768)):
+# Shared image loader (CarregaImagens.py) lives in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CarregaImagens import DecodeStats, image_size, load_image
+
+# Supported image extensions
+SUPPORTED_EXT = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff']
+
+# How each image is fitted to the target size:
+#   'stretch'   -> plain resize to target_size, aspect ratio is not kept (original behaviour)
+#   'letterbox' -> fit inside target_size keeping the aspect ratio, pad the rest with pad_color
+#   'crop'      -> cover target_size keeping the aspect ratio, cut the center
+#   'tiles'     -> cover target_size in the short direction and cut several evenly spaced (overlapping)
+#                  crops along the long one, one output per crop (name_t0.jpg, name_t1.jpg, ...)
+FIT_MODES = ('stretch', 'letterbox', 'crop', 'tiles')
+
+# Kept in dest_dir: the parameters of the last completed run. Outputs only count as up to date when the
+# parameters match (another mode, size or pad color rewrites everything)
+STATE_FILENAME = '.resize_state.json'
+
+
+def resize_to(img, size):
+    # INTER_AREA to shrink, INTER_LINEAR to enlarge
+    interpolation = cv2.INTER_AREA if size[0] * size[1] < img.shape[1] * img.shape[0] else cv2.INTER_LINEAR
+    return cv2.resize(img, size, interpolation=interpolation)
+
+
+def fit_image(img, target_size, mode='stretch', pad_color=(114, 114, 114)):
+    """
+    Fits one decoded image to target_size (width, height) using one of FIT_MODES.
+    Returns a list of images (a single one for every mode except 'tiles').
+    """
+    target_width, target_height = target_size
+    height, width = img.shape[:2]
+
+    if mode == 'stretch':
+        return [resize_to(img, target_size)]
+
+    if mode == 'letterbox':
+        scale = min(target_width / width, target_height / height)
+        new_width = min(target_width, max(1, round(width * scale)))
+        new_height = min(target_height, max(1, round(height * scale)))
+        resized = resize_to(img, (new_width, new_height))
+        left = (target_width - new_width) // 2
+        top = (target_height - new_height) // 2
+        return [cv2.copyMakeBorder(resized, top, target_height - new_height - top, left,
+                                   target_width - new_width - left, cv2.BORDER_CONSTANT, value=pad_color)]
+
+    # 'crop' and 'tiles': scale so the image covers the target, then cut
+    scale = max(target_width / width, target_height / height)
+    new_width = max(target_width, round(width * scale))
+    new_height = max(target_height, round(height * scale))
+    resized = resize_to(img, (new_width, new_height))
+
+    if mode == 'crop':
+        left = (new_width - target_width) // 2
+        top = (new_height - target_height) // 2
+        return [resized[top:top + target_height, left:left + target_width]]
+
+    if mode == 'tiles':
+        # Enough tiles to cover the long direction, evenly spaced from one edge to the other
+        num_x = math.ceil(new_width / target_width)
+        num_y = math.ceil(new_height / target_height)
+        lefts = [round(i * (new_width - target_width) / max(num_x - 1, 1)) for i in range(num_x)]
+        tops = [round(i * (new_height - target_height) / max(num_y - 1, 1)) for i in range(num_y)]
+        return [resized[top:top + target_height, left:left + target_width] for top in tops for left in lefts]
+
+    raise ValueError(f"Invalid fit mode: {mode} (use one of {FIT_MODES})")
+
+
+def size_directory(dest_dir, size, sizes):
+    # One subfolder per resolution (WxH) when more than one is requested
+    return dest_dir if len(sizes) == 1 else os.path.join(dest_dir, f"{size[0]}x{size[1]}")
+
+
+def output_names(filename, mode, num_tiles=1):
+    base_name, file_ext = os.path.splitext(filename)
+    if mode == 'tiles':
+        return [f"{base_name}_t{k}{file_ext}" for k in range(num_tiles)]
+    return [filename]
+
+
+def params_signature(sizes, mode, pad_color):
+    # Parameters that change the outputs
+    return json.dumps({'sizes': [list(size) for size in sizes], 'mode': mode, 'pad_color': list(pad_color)},
+                      sort_keys=True)
+
+
+def load_state(dest_dir):
+    state_path = os.path.join(dest_dir, STATE_FILENAME)
+    if not os.path.exists(state_path):
+        return {'params': None}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(dest_dir, state):
+    state_path = os.path.join(dest_dir, STATE_FILENAME)
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def remove_stale_tiles(size_dir, filename, num_tiles):
+    # Tiles left over from a run that cut more tiles per image (e.g. another target size)
+    base_name, file_ext = os.path.splitext(filename)
+    k = num_tiles
+    while os.path.exists(os.path.join(size_dir, f"{base_name}_t{k}{file_ext}")):
+        os.remove(os.path.join(size_dir, f"{base_name}_t{k}{file_ext}"))
+        k += 1
+
+
+def is_up_to_date(source_path, dest_dir, filename, sizes, mode):
+    # Every output exists and is newer than the source. In 'tiles' mode the number of tiles is only
+    # known after decoding, so the first tile of each resolution stands for the whole set
+    source_mtime = os.path.getmtime(source_path)
+    for size in sizes:
+        for name in output_names(filename, mode):
+            path = os.path.join(size_directory(dest_dir, size, sizes), name)
+            if not os.path.exists(path) or os.path.getmtime(path) < source_mtime:
+                return False
+    return True
+
+
+def process_image(job):
+    """
+    Decodes one image once and writes it at every requested resolution (runs in the pool processes).
+    Large JPEGs are decoded already reduced when the biggest requested size allows it (see CarregaImagens.py).
+    Returns (filename, status, number of files written, DecodeStats).
+    """
+    source_path, dest_dir, sizes, mode, pad_color, skip_unchanged = job
+    filename = os.path.basename(source_path)
+    stats = DecodeStats()
+
+    if skip_unchanged and is_up_to_date(source_path, dest_dir, filename, sizes, mode):
+        return filename, 'skipped', 0, stats
+
+    largest = (max(size[0] for size in sizes), max(size[1] for size in sizes))
+    img = load_image(source_path, largest, 'inside' if mode == 'letterbox' else 'cover', stats=stats)
+    if img is None:
+        return filename, 'failed', 0, stats
+    original_size = image_size(source_path) or (img.shape[1], img.shape[0])
+
+    written = 0
+    for size in sizes:
+        size_dir = size_directory(dest_dir, size, sizes)
+        os.makedirs(size_dir, exist_ok=True)
+
+        # Already at the target size: copy the bytes instead of decoding/re-encoding (no quality loss)
+        if tuple(original_size) == size and mode != 'tiles':
+            shutil.copy2(source_path, os.path.join(size_dir, filename))
+            written += 1
+            continue
+
+        fitted = fit_image(img, size, mode, pad_color)
+        for name, fitted_img in zip(output_names(filename, mode, len(fitted)), fitted):
+            cv2.imwrite(os.path.join(size_dir, name), fitted_img)
+            written += 1
+        if mode == 'tiles':
+            remove_stale_tiles(size_dir, filename, len(fitted))
+
+    return filename, 'resized', written, stats
+
+
+def resize_images(source_dir, dest_dir, target_size=(1024, 768), mode='stretch', sizes=None, workers=1,
+                  skip_unchanged=True, pad_color=(114, 114, 114), chunksize=None):
     """
     Resizes all images in source_dir to target_size and saves them in dest_dir.
     Maintains original file extensions and names.
+
+    mode: one of FIT_MODES ('stretch' keeps the old behaviour; 'letterbox', 'crop' and 'tiles' keep the aspect ratio).
+    sizes: list of (width, height) to emit from a single decode, e.g. [(640, 480), (1280, 960)], each one in
+           its own dest_dir/WxH subfolder. Defaults to [target_size] written straight into dest_dir.
+    workers: number of processes. skip_unchanged: skip images whose outputs are newer than the source, as long as
+             the last completed run used the same sizes, mode and pad_color (saved in dest_dir/STATE_FILENAME).
     """
+    if mode not in FIT_MODES:
+        raise ValueError(f"Invalid fit mode: {mode} (use one of {FIT_MODES})")
+    sizes = [tuple(size) for size in (sizes or [target_size])]
+
     # Create destination directory if it doesn't exist
-    if not os.path.exists(dest_dir):
-        os.makedirs(dest_dir)
-    
-    # Supported image extensions
-    supported_ext = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff']
-    
-    # Process each file in source directory
-    for filename in os.listdir(source_dir):
-        file_ext = os.path.splitext(filename)[1].lower()
-        
-        if file_ext in supported_ext:
-            try:
-                # Read the image
-                img_path = os.path.join(source_dir, filename)
-                img = cv2.imread(img_path)
-                
-                if img is not None:
-                    # Resize the image
-                    resized_img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
-                    
-                    # Save to destination
-                    dest_path = os.path.join(dest_dir, filename)
-                    cv2.imwrite(dest_path, resized_img)
-                    
-                    print(f"Resized {filename} to {target_size[0]}x{target_size[1]}")
-                else:
-                    print(f"Could not read image: {filename}")
-            except Exception as e:
-                print(f"Error processing {filename}: {str(e)}")
-
-# Example usage
-#source_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/01Backgrounds'
-#destination_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/SquareBackgrounds'
-source_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/FittedBackgroundsTeste'
-destination_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/FittedBackgroundsTeste/2'
-
-
-resize_images(source_directory, destination_directory)
\ No newline at end of file
+    os.makedirs(dest_dir, exist_ok=True)
+
+    state = load_state(dest_dir)
+    signature = params_signature(sizes, mode, pad_color)
+    same_params = state['params'] == signature
+    if not same_params:
+        # Outputs are about to be rewritten with other parameters: none of them is up to date until this
+        # run completes (an interrupted run leaves everything to be redone)
+        state['params'] = None
+        save_state(dest_dir, state)
+
+    jobs = [(os.path.join(source_dir, filename), dest_dir, sizes, mode, pad_color, skip_unchanged and same_params)
+            for filename in sorted(os.listdir(source_dir))
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_EXT]
+
+    if workers > 1 and jobs:
+        if chunksize is None:
+            chunksize = max(1, len(jobs) // (workers * 4))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(process_image, jobs, chunksize=chunksize)
+    else:
+        executor = None
+        results = map(process_image, jobs)
+
+    counts = {'resized': 0, 'skipped': 0, 'failed': 0}
+    stats = DecodeStats()
+    try:
+        for filename, status, written, job_stats in results:
+            counts[status] += 1
+            stats.merge(job_stats)
+            if status == 'resized':
+                print(f"Resized {filename} -> {written} file(s) ({mode}, {', '.join(f'{w}x{h}' for w, h in sizes)})")
+            elif status == 'failed':
+                print(f"Could not read image: {filename}")
+        state['params'] = signature
+        save_state(dest_dir, state)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"\n{counts['resized']} resized, {counts['skipped']} up to date, {counts['failed']} failed")
+    print(stats.report())
+    return counts
+
+
+if __name__ == '__main__':
+    # Example usage
+    #source_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/01Backgrounds'
+    #destination_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/SquareBackgrounds'
+    source_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/FittedBackgroundsTeste'
+    destination_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/Fundos/FittedBackgroundsTeste/2'
+
+    resize_images(source_directory, destination_directory, workers=os.cpu_count())
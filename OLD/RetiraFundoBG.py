@@ -1,6 +1,108 @@
-from rembg import remove
-import cv2
+from rembg import new_session, remove
+import hashlib
+import os
+import shutil
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-input_image = cv2.imread('/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_teste/0_arvores16.png')
-output_image = remove(input_image)  # Remove fundo automaticamente
-cv2.imwrite("/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente/0_arvores7.png", output_image)
\ No newline at end of file
+# Hash de arquivos compartilhado (ManifestoDataset.py, na pasta do projeto)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ManifestoDataset import hash_file
+
+def load_session(model_path):
+    # Cria a sessão do rembg uma única vez, só com CPU e a partir de um arquivo .onnx local
+    # ('u2net_custom' usa exatamente o model_path informado e nunca tenta baixar o modelo).
+    # Ex.: u2net.onnx copiado para a máquina de build
+    if not os.path.isfile(model_path):
+        raise FileNotFoundError(f"Modelo do rembg não encontrado: {model_path} (as máquinas de build não baixam modelos)")
+    return new_session('u2net_custom', model_path=model_path, providers=['CPUExecutionProvider'])
+
+def cache_key(data, model_id):
+    # A saída depende só dos bytes de entrada e do modelo
+    return hashlib.sha256(model_id.encode('utf-8') + b'/' + data).hexdigest()
+
+def process_image(session, input_path, output_path, cache_dir, model_id):
+    # Roda numa thread do pool (o onnxruntime libera o GIL durante a inferência)
+    start = time.perf_counter()
+    with open(input_path, 'rb') as f:
+        data = f.read()
+
+    cached_path = None
+    if cache_dir is not None:
+        cached_path = os.path.join(cache_dir, cache_key(data, model_id) + '.png')
+        if os.path.exists(cached_path):
+            shutil.copyfile(cached_path, output_path)
+            return 'cached', time.perf_counter() - start
+
+    # Passa os bytes direto: o rembg decodifica em RGB e devolve um PNG RGBA
+    output = remove(data, session=session)
+
+    with open(output_path, 'wb') as f:
+        f.write(output)
+    if cached_path is not None:
+        with open(cached_path + '.tmp', 'wb') as f:
+            f.write(output)
+        os.replace(cached_path + '.tmp', cached_path)
+    return 'processed', time.perf_counter() - start
+
+def remove_background_bulk(input_dir, output_dir, model_path, cache_dir=None, workers=4, queue_size=16):
+    # Remove o fundo de todas as imagens da pasta com uma única sessão do rembg.
+    # As imagens passam por uma fila limitada (queue_size) para um pool de `workers` threads;
+    # resultados ficam num cache por hash da entrada (cache_dir), então reexecuções não rodam o modelo de novo
+    os.makedirs(output_dir, exist_ok=True)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    session = load_session(model_path)
+    # O modelo entra na chave do cache pelo conteúdo: um u2net.onnx retreinado tem o mesmo nome e tamanho
+    model_id = hash_file(model_path)
+
+    filenames = [f for f in sorted(os.listdir(input_dir))
+                 if os.path.splitext(f)[1].lower() in ['.png', '.jpg', '.jpeg']]
+
+    counts = {'processed': 0, 'cached': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    def finish(filename, future):
+        try:
+            status, seconds = future.result()
+        except Exception as e:
+            counts['failed'] += 1
+            print(f"Erro ao processar {filename}: {e}")
+            return
+        counts[status] += 1
+        print(f"{'Processed' if status == 'processed' else 'Cached'}: {filename} ({seconds * 1000:.0f} ms)")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for filename in filenames:
+            # Saída sempre em PNG (precisa do canal alfa)
+            output_path = os.path.join(output_dir, os.path.splitext(filename)[0] + '.png')
+            future = executor.submit(process_image, session, os.path.join(input_dir, filename),
+                                     output_path, cache_dir, model_id)
+            pending.append((filename, future))
+
+            # Fila limitada: espera a imagem mais antiga antes de mandar mais
+            if len(pending) >= queue_size:
+                finish(*pending.popleft())
+
+        while pending:
+            finish(*pending.popleft())
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{counts['processed']} processadas, {counts['cached']} do cache, {counts['failed']} com erro -- {elapsed:.1f}s")
+    return counts
+
+
+if __name__ == '__main__':
+    input_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_teste'
+    output_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente'
+    cache_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/.cache_rembg'
+    # Modelo baixado uma vez e guardado localmente (ex.: ~/.u2net/u2net.onnx)
+    model_file = os.path.expanduser('~/.u2net/u2net.onnx')
+
+    # Uso: python RetiraFundoBG.py [pasta_de_entrada] [pasta_de_saida] [modelo.onnx]
+    args = sys.argv[1:] + [input_directory, output_directory, model_file][len(sys.argv[1:]):]
+    remove_background_bulk(args[0], args[1], args[2], cache_dir=cache_directory, workers=os.cpu_count())
@@ -1,42 +1,126 @@
 import cv2
 import numpy as np
 import os
+import sys
+import time
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
-def remove_background_and_save(input_dir, output_dir, threshold=150):
+def remove_small_components(alpha, min_size=50, connectivity=4):
+    # Remove pixels isolados / pequenos residuos do alfa (uint8), no proprio array.
+    # Mesmo resultado do morphology.remove_small_objects(alpha.astype(bool), min_size) do scikit-image
+    # (conectividade 4, remove objetos com menos de min_size pixels, alfa final 0/255), mas com
+    # connectedComponentsWithStats do OpenCV e sem copias bool/uint8 da imagem inteira
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(alpha, connectivity=connectivity)
+
+    # Tabela: para cada componente, 255 se fica e 0 se é pequeno demais (o rótulo 0 é o fundo)
+    keep = np.where(stats[:, cv2.CC_STAT_AREA] >= min_size, 255, 0).astype(np.uint8)
+    keep[0] = 0
+    np.take(keep, labels, out=alpha)
+    return alpha
+
+def clean_alpha(img, threshold=150, min_size=50):
+    # Garante BGRA (PNGs sem alfa ficam opacos) e limpa o alfa.
+    # Se img já for BGRA, é alterada no próprio lugar
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    elif img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+
+    # Método aprimorado (considera pixels onde TODOS os canais são ≥ threshold)
+    bgr = img[:, :, :3]
+    white_mask = cv2.inRange(bgr, (threshold, threshold, threshold), (255, 255, 255))
+
+    # Aplica transparência + remove pequenos resíduos
+    alpha = cv2.extractChannel(img, 3)
+    cv2.bitwise_not(white_mask, dst=white_mask)
+    cv2.bitwise_and(alpha, white_mask, dst=alpha)
+    remove_small_components(alpha, min_size)
+    cv2.insertChannel(alpha, img, 3)
+    return img
+
+def clean_alpha_skimage(img, threshold=150, min_size=50):
+    # Caminho antigo (scikit-image), mantido só como referência para o benchmark
+    from skimage import morphology
+
+    if img.shape[2] == 4:
+        img_rgba = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
+    else:
+        img_rgba = cv2.cvtColor(img, cv2.COLOR_BGR2RGBA)
+
+    rgb = img_rgba[:, :, :3]
+    white_mask = np.all(rgb >= threshold, axis=-1)
+    img_rgba[:, :, 3] = np.where(white_mask, 0, img_rgba[:, :, 3])
+
+    alpha_channel = img_rgba[:, :, 3]
+    alpha_channel = morphology.remove_small_objects(alpha_channel.astype(bool), min_size=min_size)
+    img_rgba[:, :, 3] = alpha_channel.astype(np.uint8) * 255
+
+    return cv2.cvtColor(img_rgba, cv2.COLOR_RGBA2BGRA)
+
+def process_image(job):
+    input_path, output_path, threshold, min_size = job
+    img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return os.path.basename(input_path), False
+
+    cv2.imwrite(output_path, clean_alpha(img, threshold, min_size))
+    return os.path.basename(input_path), True
+
+def remove_background_and_save(input_dir, output_dir, threshold=150, min_size=50, workers=1):
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    
-    for filename in os.listdir(input_dir):
-        if not filename.lower().endswith('.png'):
-            continue
-            
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename)
-        
-        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-        
-        if img.shape[2] == 4:
-            img_rgba = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
+
+    jobs = [(os.path.join(input_dir, filename), os.path.join(output_dir, filename), threshold, min_size)
+            for filename in sorted(os.listdir(input_dir))
+            if filename.lower().endswith('.png')]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process_image, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = map(process_image, jobs)
+
+    for filename, ok in results:
+        if ok:
+            print(f"Processed: {filename} (Threshold={threshold})")
         else:
-            img_rgba = cv2.cvtColor(img, cv2.COLOR_BGR2RGBA)
-        
-        # Método aprimorado (considera pixels onde TODOS os canais são ≥ threshold)
-        rgb = img_rgba[:, :, :3]
-        white_mask = np.all(rgb >= threshold, axis=-1)
-        
-        # Aplica transparência + remove pequenos resíduos com morfologia
-        img_rgba[:, :, 3] = np.where(white_mask, 0, img_rgba[:, :, 3])
-        
-        # Opcional: remove pixels isolados (descomente se necessário)
-        from skimage import morphology
-        alpha_channel = img_rgba[:, :, 3]
-        alpha_channel = morphology.remove_small_objects(alpha_channel.astype(bool), min_size=50)
-        img_rgba[:, :, 3] = alpha_channel.astype(np.uint8) * 255
-        
-        cv2.imwrite(output_path, cv2.cvtColor(img_rgba, cv2.COLOR_RGBA2BGRA))
-        print(f"Processed: {filename} (Threshold={threshold})")
-# Exemplo de uso:
-input_directory =  "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG"
-output_directory = "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente"
-
-remove_background_and_save(input_directory, output_directory)
+            print(f"Não foi possivel ler a imagem: {filename}")
+
+def benchmark_cleanup(input_dir, threshold=150, min_size=50, limit=None):
+    # Compara o caminho antigo (scikit-image) com o novo (OpenCV) nas mesmas imagens já decodificadas
+    filenames = [f for f in sorted(os.listdir(input_dir)) if f.lower().endswith('.png')][:limit]
+    images = [img for img in (cv2.imread(os.path.join(input_dir, f), cv2.IMREAD_UNCHANGED) for f in filenames)
+              if img is not None]
+    print(f"{len(images)} imagens de {input_dir}")
+
+    start = time.perf_counter()
+    opencv_results = [clean_alpha(img.copy(), threshold, min_size) for img in images]
+    opencv_time = time.perf_counter() - start
+    print(f"OpenCV:       {opencv_time:.2f}s ({opencv_time / len(images) * 1000:.1f} ms/imagem)")
+
+    try:
+        import skimage  # noqa: F401
+    except ImportError:
+        print("scikit-image não instalado, comparação com o caminho antigo não executada")
+        return opencv_time, None
+
+    start = time.perf_counter()
+    skimage_results = [clean_alpha_skimage(img, threshold, min_size) for img in images]
+    skimage_time = time.perf_counter() - start
+    print(f"scikit-image: {skimage_time:.2f}s ({skimage_time / len(images) * 1000:.1f} ms/imagem)")
+
+    differences = sum(not np.array_equal(a, b) for a, b in zip(opencv_results, skimage_results))
+    print(f"Speedup: {skimage_time / opencv_time:.1f}x -- {differences} imagens com resultado diferente")
+    return opencv_time, skimage_time
+
+
+if __name__ == '__main__':
+    # Exemplo de uso:
+    input_directory =  "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG"
+    output_directory = "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente"
+
+    # python RetiraFundoPNG2.py bench -> compara com o caminho antigo (scikit-image) na pasta de entrada
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        benchmark_cleanup(sys.argv[2] if len(sys.argv) > 2 else input_directory)
+    else:
+        remove_background_and_save(input_directory, output_directory, workers=os.cpu_count())
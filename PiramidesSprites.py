@@ -0,0 +1,161 @@
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from CacheSprites import premultiply_alpha
+
+# Piramides dos sprites de arvore: cada sprite (recortado na caixa do alfa, BGRA pre-multiplicado) e
+# reduzido com INTER_AREA uma unica vez para varias escalas (LEVELS_PER_OCTAVE niveis por oitava) e
+# guardado em disco. Para colar numa escala qualquer, o compositor pega o menor nivel que ainda e maior que
+# o tamanho pedido e faz so um resize pequeno a partir dele, em vez de reduzir o PNG inteiro a cada colagem.
+#
+# Os arquivos ficam em PYRAMID_DIRNAME dentro da pasta das arvores, um .npz (sem compressao) por sprite.
+# O nome do arquivo leva um hash do tamanho/data do PNG, do recorte e dos parametros da piramide, entao
+# uma arvore modificada simplesmente ganha um arquivo novo. Cada arquivo tambem guarda esses dados (membro
+# 'meta'), para build_pyramids apagar so os de PNGs apagados ou modificados: piramides de outros parametros
+# (outro limiar do alfa, outros niveis) e de arvores fora do catalogo desta execucao continuam no cache
+PYRAMID_DIRNAME = '.sprite_pyramids'
+LEVELS_PER_OCTAVE = 2
+MIN_LEVEL_SIZE = 16
+
+# Distribuicoes de escala (altura da arvore / altura do fundo) aceitas em sample_scale
+SCALE_DISTRIBUTIONS = ('uniform', 'loguniform', 'normal')
+
+
+def level_sizes(width, height, levels_per_octave=LEVELS_PER_OCTAVE, min_size=MIN_LEVEL_SIZE):
+    # Tamanhos (largura, altura) dos niveis: escala 2 ** (-k / levels_per_octave), ate o lado menor
+    # ficar abaixo de min_size (o nivel 0, tamanho original, sempre existe)
+    sizes = [(width, height)]
+    k = 1
+    while True:
+        scale = 2 ** (-k / levels_per_octave)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if min(size) < min_size:
+            return sizes
+        sizes.append(size)
+        k += 1
+
+
+def choose_level(sizes, size):
+    # Menor nivel com largura e altura >= size (o resize final so reduz); o nivel 0 se size for maior
+    for index in range(len(sizes) - 1, -1, -1):
+        if sizes[index][0] >= size[0] and sizes[index][1] >= size[1]:
+            return index
+    return 0
+
+
+def source_signature(tree_path):
+    stat = os.stat(tree_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def pyramid_path(tree_path, crop_box=None, levels_per_octave=LEVELS_PER_OCTAVE, min_size=MIN_LEVEL_SIZE):
+    size, mtime_ns = source_signature(tree_path)
+    signature = f"{size}/{mtime_ns}/{crop_box}/{levels_per_octave}/{min_size}"
+    digest = hashlib.sha256(signature.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(tree_path))[0]
+    return os.path.join(os.path.dirname(tree_path), PYRAMID_DIRNAME, f"{name}.{digest}.npz")
+
+
+def build_pyramid(sprite, levels_per_octave=LEVELS_PER_OCTAVE, min_size=MIN_LEVEL_SIZE):
+    # Todos os niveis reduzidos direto do original com INTER_AREA (filtro de area, sem serrilhado)
+    height, width = sprite.shape[:2]
+    return [sprite if size == (width, height) else cv2.resize(sprite, size, interpolation=cv2.INTER_AREA)
+            for size in level_sizes(width, height, levels_per_octave, min_size)]
+
+
+def build_pyramid_file(job):
+    # Roda nos processos do pool. Devolve (caminho da arvore, ok)
+    tree_path, crop_box, levels_per_octave, min_size, output_path = job
+    tree = cv2.imread(tree_path, cv2.IMREAD_UNCHANGED)
+    if tree is None:
+        return tree_path, False
+    if crop_box is not None:
+        x, y, width, height = crop_box
+        tree = tree[y:y+height, x:x+width]
+
+    levels = build_pyramid(premultiply_alpha(tree), levels_per_octave, min_size)
+    meta = {'source': os.path.basename(tree_path), 'signature': source_signature(tree_path),
+            'levels_per_octave': levels_per_octave, 'min_size': min_size}
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **{f"level_{i}": level for i, level in enumerate(levels)})
+    os.replace(tmp_path, output_path)
+    return tree_path, True
+
+
+def is_stale(path, tree_directory):
+    # Piramide de um PNG que foi apagado ou modificado depois dela. Arquivos sem 'meta' (ou ilegiveis)
+    # so sao considerados velhos se nao houver mais PNG com o mesmo nome
+    try:
+        with np.load(path) as pyramid:
+            meta = json.loads(str(pyramid['meta']))
+    except (KeyError, OSError, ValueError):
+        stem = os.path.basename(path).split('.')[0]
+        return not any(os.path.splitext(name)[0] == stem for name in os.listdir(tree_directory))
+    tree_path = os.path.join(tree_directory, meta['source'])
+    return not os.path.exists(tree_path) or source_signature(tree_path) != meta['signature']
+
+
+def build_pyramids(catalog, levels_per_octave=LEVELS_PER_OCTAVE, min_size=MIN_LEVEL_SIZE, workers=1):
+    # Garante a piramide de cada arvore do catalogo (recortada na caixa do alfa). So as que faltam
+    # sao montadas (em paralelo); arquivos de PNGs apagados ou modificados sao apagados
+    pyramid_dir = os.path.join(catalog.tree_directory, PYRAMID_DIRNAME)
+    os.makedirs(pyramid_dir, exist_ok=True)
+
+    indices = range(len(catalog))
+    expected = {}
+    for tree_path, crop_box in zip(catalog.paths(indices), catalog.crop_boxes(indices)):
+        expected[pyramid_path(tree_path, crop_box, levels_per_octave, min_size)] = (tree_path, crop_box)
+
+    # Os que nao sao desta execucao so saem se o PNG de origem sumiu ou mudou: outra execucao pode usar
+    # outros parametros (ou outro catalogo, ex.: com dedupe_inputs) e reaproveitar o resto
+    for filename in os.listdir(pyramid_dir):
+        path = os.path.join(pyramid_dir, filename)
+        if filename.endswith('.npz') and path not in expected and is_stale(path, catalog.tree_directory):
+            os.remove(path)
+
+    jobs = [(tree_path, crop_box, levels_per_octave, min_size, path)
+            for path, (tree_path, crop_box) in expected.items() if not os.path.exists(path)]
+    if not jobs:
+        return 0
+
+    start = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(build_pyramid_file, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = list(map(build_pyramid_file, jobs))
+
+    for tree_path, ok in results:
+        if not ok:
+            print(f"Imagem não conseguiu ser lida: {tree_path}")
+    print(f"{len(jobs)} piramides de sprites montadas em {time.perf_counter() - start:.1f}s")
+    return len(jobs)
+
+
+def load_level(path, index):
+    # Le um unico nivel do .npz (o zip so descompacta o membro pedido)
+    with np.load(path) as pyramid:
+        return pyramid[f"level_{index}"]
+
+
+def sample_scale(scales, rng):
+    # Sorteia a escala (altura da arvore / altura do fundo) com o random.Random da composicao.
+    # scales: {'distribution': 'uniform' | 'loguniform', 'min': ..., 'max': ...}
+    #      ou {'distribution': 'normal', 'mean': ..., 'std': ..., 'min': ..., 'max': ...} (cortada em min/max)
+    distribution = scales.get('distribution', 'uniform')
+    low, high = scales['min'], scales['max']
+    if distribution == 'uniform':
+        return rng.uniform(low, high)
+    if distribution == 'loguniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if distribution == 'normal':
+        return min(max(rng.gauss(scales['mean'], scales['std']), low), high)
+    raise ValueError(f"Distribuição de escala inválida: {distribution} (use uma de {SCALE_DISTRIBUTIONS})")
@@ -0,0 +1,121 @@
+import numpy as np
+import cv2
+
+from CatalogoArvores import ALPHA_THRESHOLD
+
+# Posicionamento das arvores com controle de sobreposicao, para cenas densas (centenas de arvores por imagem).
+#
+# - Uma grade de ocupacao (celulas de `cell` pixels, cada uma com a fracao ja coberta por arvores) com a
+#   imagem integral dela: a fracao ocupada do retangulo de qualquer posicao candidata sai em O(1), e
+#   `attempts` candidatas sorteadas sao testadas de uma vez com numpy (rejection sampling vetorizado),
+#   sem comparar a nova arvore com cada uma das anteriores
+# - Um mapa de instancias (id da arvore visivel em cada pixel): a candidata aceita so e usada se nenhuma
+#   arvore ja colada perder mais que max_occlusion da sua area visivel
+# - Os labels saem do mapa de instancias depois de todas as colagens: a caixa de cada arvore e a caixa
+#   dos pixels dela que continuam visiveis (arvores quase totalmente escondidas ficam sem label)
+
+
+class PlacementEngine:
+
+    def __init__(self, height, width, max_overlap=0.3, max_occlusion=0.5, min_visible=0.25, attempts=64, cell=8,
+                 alpha_threshold=ALPHA_THRESHOLD):
+        # max_overlap: fracao maxima do retangulo da nova arvore que ja pode estar ocupada
+        # max_occlusion: fracao maxima da area de uma arvore ja colada que a nova pode esconder
+        # min_visible: arvores com menos que essa fracao da area original visivel nao recebem label
+        # attempts: posicoes sorteadas por arvore; se nenhuma servir, a arvore nao e colada
+        self.height = height
+        self.width = width
+        self.max_overlap = max_overlap
+        self.max_occlusion = max_occlusion
+        self.min_visible = min_visible
+        self.attempts = attempts
+        self.cell = cell
+        self.alpha_threshold = alpha_threshold
+
+        grid_height = -(-height // cell)
+        grid_width = -(-width // cell)
+        # Mascara ocupada do tamanho da grade (multiplo de cell), a grade e a media dela em cada celula
+        self.occupied = np.zeros((grid_height * cell, grid_width * cell), dtype=np.uint8)
+        self.occupancy = np.zeros((grid_height, grid_width), dtype=np.float32)
+        self._integral = None
+
+        self.instance_map = np.zeros((height, width), dtype=np.int32)
+        self.rects = []
+        self.visible_areas = np.zeros(0, dtype=np.int64)
+        self.original_areas = np.zeros(0, dtype=np.int64)
+
+    def sprite_mask(self, sprite):
+        # Pixels visiveis de um sprite BGRA
+        return sprite[:, :, 3] > self.alpha_threshold
+
+    def overlap_fractions(self, xs, ys, width, height):
+        # Fracao ocupada do retangulo (celulas que ele toca) para cada candidata (xs, ys sao arrays)
+        if self._integral is None:
+            self._integral = cv2.integral(self.occupancy, sdepth=cv2.CV_64F)
+        integral = self._integral
+        gx0 = xs // self.cell
+        gy0 = ys // self.cell
+        gx1 = -(-(xs + width) // self.cell)
+        gy1 = -(-(ys + height) // self.cell)
+        total = integral[gy1, gx1] - integral[gy0, gx1] - integral[gy1, gx0] + integral[gy0, gx0]
+        return total / ((gx1 - gx0) * (gy1 - gy0))
+
+    def occlusion_ok(self, mask, x, y):
+        # Nenhuma arvore ja colada pode ficar com menos de (1 - max_occlusion) da area original
+        if not self.rects or self.max_occlusion >= 1:
+            return True
+        height, width = mask.shape
+        covered = np.bincount(self.instance_map[y:y + height, x:x + width][mask], minlength=len(self.rects) + 1)[1:]
+        return bool(np.all(self.visible_areas - covered >= (1 - self.max_occlusion) * self.original_areas))
+
+    def place(self, mask, rng):
+        # Sorteia `attempts` posicoes de uma vez (rng: numpy Generator) e devolve a primeira que respeita
+        # max_overlap e max_occlusion, ou None
+        height, width = mask.shape
+        if width > self.width or height > self.height:
+            return None
+        xs = rng.integers(0, self.width - width + 1, self.attempts)
+        ys = rng.integers(0, self.height - height + 1, self.attempts)
+
+        for i in np.flatnonzero(self.overlap_fractions(xs, ys, width, height) <= self.max_overlap):
+            x, y = int(xs[i]), int(ys[i])
+            if self.occlusion_ok(mask, x, y):
+                return x, y
+        return None
+
+    def commit(self, mask, x, y):
+        # Registra a arvore colada em (x, y): ela fica por cima das anteriores
+        height, width = mask.shape
+        area = int(np.count_nonzero(mask))
+        instance_id = len(self.rects) + 1
+
+        region = self.instance_map[y:y + height, x:x + width]
+        covered = np.bincount(region[mask], minlength=instance_id)[1:]
+        self.visible_areas -= covered
+        region[mask] = instance_id
+
+        self.rects.append((x, y, width, height))
+        self.visible_areas = np.append(self.visible_areas, area)
+        self.original_areas = np.append(self.original_areas, area)
+
+        # Atualiza a grade so nas celulas tocadas pela arvore
+        occupied_region = self.occupied[y:y + height, x:x + width]
+        occupied_region[mask] = 255
+        gx0, gy0 = x // self.cell, y // self.cell
+        gx1, gy1 = -(-(x + width) // self.cell), -(-(y + height) // self.cell)
+        block = self.occupied[gy0 * self.cell:gy1 * self.cell, gx0 * self.cell:gx1 * self.cell]
+        self.occupancy[gy0:gy1, gx0:gx1] = cv2.resize(block, (gx1 - gx0, gy1 - gy0),
+                                                      interpolation=cv2.INTER_AREA) / np.float32(255)
+        self._integral = None
+
+    def visible_boxes(self):
+        # Caixas (x, y, largura, altura) dos pixels visiveis de cada arvore, na ordem das colagens;
+        # arvores com menos de min_visible da area original visivel ficam de fora
+        boxes = []
+        for index, (x, y, width, height) in enumerate(self.rects):
+            if self.visible_areas[index] < self.min_visible * self.original_areas[index]:
+                continue
+            visible = (self.instance_map[y:y + height, x:x + width] == index + 1).astype(np.uint8)
+            box_x, box_y, box_width, box_height = cv2.boundingRect(visible)
+            boxes.append((x + box_x, y + box_y, box_width, box_height))
+        return boxes
@@ -0,0 +1,216 @@
+import glob
+import os
+import random
+import shutil
+
+import cv2
+import numpy as np
+
+# Formato dos shards:
+#   shard_00000.bin      -> registros concatenados: caixas float32 (N, 5) seguidas dos bytes da imagem codificada,
+#                           cada registro alinhado em 8 bytes
+#   shard_00000.idx.npy  -> indice com uma linha por registro (offset, tamanho da imagem, numero de caixas)
+# Um shard so ganha o indice quando e fechado, entao shards incompletos (ex.: execucao interrompida) sao ignorados.
+# Por padrao o ShardWriter monta o conjunto numa pasta temporaria ao lado e so no close troca a pasta antiga
+# pela nova: remontar substitui os shards (quem le a pasta no meio da montagem ve o conjunto antigo inteiro)
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('image_size', '<u4'), ('num_boxes', '<u4')])
+BOX_DTYPE = np.dtype('<f4')
+RECORD_ALIGNMENT = 8
+
+
+class ShardWriter:
+    # Grava amostras (imagem + caixas YOLO) em shards de tamanho fixo (shard_size amostras cada)
+    # append=True acrescenta shards aos que ja existem em output_dir (continuando a numeracao), em vez de
+    # substituir o conjunto
+
+    def __init__(self, output_dir, shard_size=1024, image_ext='.jpg', jpeg_quality=95, prefix='shard', append=False):
+        self.final_dir = output_dir
+        self.append = append
+        if append:
+            self.output_dir = output_dir
+        else:
+            # Pasta temporaria (restos de uma execucao interrompida sao descartados)
+            self.output_dir = os.path.normpath(output_dir) + '.tmp'
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.shard_size = shard_size
+        self.image_ext = image_ext
+        self.jpeg_quality = jpeg_quality
+        self.prefix = prefix
+        self.num_samples = 0
+        self._closed = False
+
+        # Com append, continua a numeracao depois dos shards que ja existem na pasta
+        self._shard_number = len(glob.glob(os.path.join(self.output_dir, f"{prefix}_*.idx.npy")))
+        self._file = None
+        self._index = []
+        self._offset = 0
+
+    def _open_shard(self):
+        self._bin_path = os.path.join(self.output_dir, f"{self.prefix}_{self._shard_number:05d}.bin")
+        self._file = open(self._bin_path + '.tmp', 'wb')
+        self._index = []
+        self._offset = 0
+
+    def _close_shard(self):
+        self._file.close()
+        os.replace(self._bin_path + '.tmp', self._bin_path)
+
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        index_path = os.path.join(self.output_dir, f"{self.prefix}_{self._shard_number:05d}.idx.npy")
+        np.save(index_path + '.tmp.npy', index)
+        os.replace(index_path + '.tmp.npy', index_path)
+
+        self._file = None
+        self._shard_number += 1
+
+    def encode(self, image):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality] if self.image_ext in ('.jpg', '.jpeg') else []
+        ok, encoded = cv2.imencode(self.image_ext, image, params)
+        if not ok:
+            raise ValueError(f"Nao foi possivel codificar a imagem como {self.image_ext}")
+        return encoded.tobytes()
+
+    def add(self, boxes, image=None, encoded=None):
+        # Recebe a imagem (BGR) ou os bytes ja codificados (ex.: codificados num processo do pool)
+        if encoded is None:
+            encoded = self.encode(image)
+        boxes = np.ascontiguousarray(boxes, dtype=BOX_DTYPE).reshape(-1, 5)
+
+        if self._file is None:
+            self._open_shard()
+
+        box_bytes = boxes.tobytes()
+        record_size = len(box_bytes) + len(encoded)
+        padding = -record_size % RECORD_ALIGNMENT
+
+        self._file.write(box_bytes)
+        self._file.write(encoded)
+        self._file.write(b'\0' * padding)
+        self._index.append((self._offset, len(encoded), len(boxes)))
+        self._offset += record_size + padding
+        self.num_samples += 1
+
+        if len(self._index) >= self.shard_size:
+            self._close_shard()
+
+    def close(self):
+        # Fecha o ultimo shard e, sem append, troca a pasta antiga pela nova
+        if self._closed:
+            return
+        self._closed = True
+        if self._file is not None:
+            self._close_shard()
+        if self.append:
+            return
+
+        old_dir = os.path.normpath(self.final_dir) + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.final_dir):
+            os.rename(self.final_dir, old_dir)
+        os.rename(self.output_dir, self.final_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def abort(self):
+        # Desiste da montagem (ex.: erro no meio): sem append, a pasta antiga fica como estava
+        if self._closed:
+            return
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._bin_path + '.tmp')
+            self._file = None
+        if not self.append:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class ShardReader:
+    # Leitura com acesso aleatorio: reader[n] devolve (imagem BGR, caixas float32 (N, 5)) da amostra n.
+    # Os .bin sao mapeados em memoria (np.memmap), so as paginas do registro pedido sao lidas do disco.
+    # Tem __len__ e __getitem__, entao tambem serve direto como Dataset de um DataLoader
+
+    def __init__(self, shard_dir, prefix='shard'):
+        self.shard_dir = shard_dir
+        index_paths = sorted(glob.glob(os.path.join(shard_dir, f"{prefix}_*.idx.npy")))
+        self._bin_paths = [path[:-len('.idx.npy')] + '.bin' for path in index_paths]
+        self._indexes = [np.load(path) for path in index_paths]
+
+        # Primeira amostra global de cada shard, para achar o shard da amostra n com busca binaria
+        counts = [len(index) for index in self._indexes]
+        self._starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._maps = [None] * len(self._bin_paths)
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def num_shards(self):
+        return len(self._bin_paths)
+
+    def shard_length(self, shard):
+        return len(self._indexes[shard])
+
+    def locate(self, n):
+        # (shard, posicao dentro do shard) da amostra global n
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError(f"Amostra {n} fora do intervalo (0..{len(self) - 1})")
+        shard = int(np.searchsorted(self._starts, n, side='right')) - 1
+        return shard, n - int(self._starts[shard])
+
+    def _map(self, shard):
+        if self._maps[shard] is None:
+            self._maps[shard] = np.memmap(self._bin_paths[shard], dtype=np.uint8, mode='r')
+        return self._maps[shard]
+
+    def read_record(self, shard, position):
+        # Bytes da imagem (sem decodificar) e caixas de um registro
+        offset, image_size, num_boxes = self._indexes[shard][position]
+        data = self._map(shard)
+        box_end = int(offset) + int(num_boxes) * 5 * BOX_DTYPE.itemsize
+        boxes = np.frombuffer(data[int(offset):box_end], dtype=BOX_DTYPE).reshape(-1, 5).copy()
+        encoded = data[box_end:box_end + int(image_size)]
+        return encoded, boxes
+
+    def read_raw(self, n):
+        return self.read_record(*self.locate(n))
+
+    def __getitem__(self, n):
+        encoded, boxes = self.read_raw(n)
+        image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        return image, boxes
+
+    def __getstate__(self):
+        # Ao ser enviado para outro processo (ex.: workers do DataLoader), cada um reabre seus memmaps
+        state = self.__dict__.copy()
+        state['_maps'] = [None] * len(self._bin_paths)
+        return state
+
+
+def iter_shard_samples(shard_dir, shuffle=True, seed=None):
+    # Loader em cima do ShardReader: percorre todas as amostras uma vez (uma epoca).
+    # Com shuffle, embaralha a ordem dos shards e a ordem dentro de cada shard; assim a leitura
+    # continua concentrada num shard de cada vez (bom para o cache de paginas) e a ordem muda a cada semente
+    reader = shard_dir if isinstance(shard_dir, ShardReader) else ShardReader(shard_dir)
+    rng = random.Random(seed)
+
+    shard_order = list(range(reader.num_shards()))
+    if shuffle:
+        rng.shuffle(shard_order)
+
+    for shard in shard_order:
+        positions = list(range(reader.shard_length(shard)))
+        if shuffle:
+            rng.shuffle(positions)
+        for position in positions:
+            encoded, boxes = reader.read_record(shard, position)
+            yield cv2.imdecode(encoded, cv2.IMREAD_COLOR), boxes
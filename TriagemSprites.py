@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from CatalogoArvores import ALPHA_THRESHOLD
+from IndiceDuplicatas import DUPLICATE_DISTANCE, dhash, unique_images
+
+# Triagem automatica dos sprites antes da revisao manual (Limpeza_das_imagens.py).
+# Para cada PNG calcula algumas metricas (em paralelo) e, com elas, uma nota de "ruindade":
+#   opaque_ratio     -> fracao dos pixels com alfa > ALPHA_THRESHOLD (sprite quase vazio = ruim)
+#   white_fringe     -> fracao da borda do alfa que ainda e branca (resto do fundo branco, ver ContaBrancos.py)
+#   alpha_components -> quantidade de pedacos soltos no alfa (residuos da remocao de fundo)
+#   blur             -> variancia do laplaciano nos pixels visiveis (baixa = imagem borrada)
+#   dhash            -> hash perceptual de 64 bits (IndiceDuplicatas.py), so informativo no relatorio
+# Os repetidos vem do indice perceptual da pasta (IndiceDuplicatas.py): dHash e pHash a ate
+# duplicate_distance bits, entao copias reescaladas ou recomprimidas tambem contam
+METRICS = ('opaque_ratio', 'white_fringe', 'alpha_components', 'blur')
+
+# Pixels com os tres canais >= WHITE_LEVEL contam como branco
+WHITE_LEVEL = 230
+# Largura (em pixels) da faixa da borda do alfa onde o branco e procurado
+FRINGE_WIDTH = 2
+
+# Peso de cada criterio na nota final (cada criterio vai de 0 = bom a 1 = ruim)
+SCORE_WEIGHTS = {'empty': 2.0, 'white_fringe': 1.5, 'alpha_components': 1.0, 'blur': 1.0, 'duplicate': 2.0}
+
+# Rejeitados automaticamente (auto_reject=True): quase vazio, borda quase toda branca ou repetido
+REJECT_MIN_OPAQUE_RATIO = 0.01
+REJECT_MAX_WHITE_FRINGE = 0.5
+
+
+def sprite_metrics(img, alpha_threshold=ALPHA_THRESHOLD):
+    # Metricas de um sprite ja decodificado (BGRA ou BGR; sem alfa = totalmente opaco)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    bgr = img[:, :, :3]
+    if img.shape[2] == 4:
+        _, mask = cv2.threshold(img[:, :, 3], alpha_threshold, 255, cv2.THRESH_BINARY)
+    else:
+        mask = np.full(img.shape[:2], 255, dtype=np.uint8)
+
+    visible = cv2.countNonZero(mask)
+    opaque_ratio = visible / mask.size
+    if visible == 0:
+        return {'opaque_ratio': 0.0, 'white_fringe': 0.0, 'alpha_components': 0, 'blur': 0.0,
+                'dhash': dhash(bgr)}
+
+    # Faixa da borda: pixels visiveis que somem com uma erosao de FRINGE_WIDTH pixels
+    eroded = cv2.erode(mask, np.ones((3, 3), np.uint8), iterations=FRINGE_WIDTH)
+    band = cv2.subtract(mask, eroded)
+    white = cv2.inRange(bgr, (WHITE_LEVEL, WHITE_LEVEL, WHITE_LEVEL), (255, 255, 255))
+    band_pixels = cv2.countNonZero(band)
+    white_fringe = cv2.countNonZero(cv2.bitwise_and(white, band)) / band_pixels if band_pixels else 0.0
+
+    num_labels, _ = cv2.connectedComponents(mask, connectivity=8)
+
+    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+    _, stddev = cv2.meanStdDev(laplacian, mask=mask)
+
+    # Hash do sprite sobre fundo preto: o mesmo recorte com fundos transparentes diferentes bate
+    return {'opaque_ratio': opaque_ratio, 'white_fringe': white_fringe, 'alpha_components': num_labels - 1,
+            'blur': float(stddev[0, 0]) ** 2, 'dhash': dhash(cv2.bitwise_and(bgr, bgr, mask=mask))}
+
+
+def measure_sprite(path):
+    # Roda nos processos do pool. Devolve (nome, metricas) ou (nome, None) se nao conseguiu ler
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return os.path.basename(path), None
+    return os.path.basename(path), sprite_metrics(img)
+
+
+def score_sprites(names, metrics, representatives=None):
+    # Nota de todos os sprites de uma vez (arrays numpy, uma coluna por metrica). Maior = pior.
+    # representatives: {nome: representante do grupo de quase repetidos} (ver IndiceDuplicatas.unique_images);
+    # um sprite cujo representante e outro (o primeiro do grupo em ordem alfabetica) conta como repetido
+    values = np.array([[m[k] for k in METRICS] for m in metrics], dtype=np.float64).reshape(-1, len(METRICS))
+    opaque_ratio, white_fringe, alpha_components, blur = values.T
+
+    representatives = representatives or {}
+    duplicate_of = [representatives.get(name, name) for name in names]
+    duplicate = np.array([d != name for d, name in zip(duplicate_of, names)], dtype=np.float64)
+
+    badness = {
+        'empty': np.clip((0.05 - opaque_ratio) / 0.05, 0, 1),
+        'white_fringe': np.clip(white_fringe / 0.2, 0, 1),
+        'alpha_components': np.clip((alpha_components - 1) / 10, 0, 1),
+        'blur': np.clip((100 - blur) / 100, 0, 1),
+        'duplicate': duplicate,
+    }
+    scores = sum(SCORE_WEIGHTS[k] * v for k, v in badness.items())
+    rejected = (opaque_ratio < REJECT_MIN_OPAQUE_RATIO) | (white_fringe > REJECT_MAX_WHITE_FRINGE) | (duplicate > 0)
+    return scores, rejected, duplicate_of
+
+
+def triage_sprites(directory, workers=1, chunksize=None, duplicate_distance=DUPLICATE_DISTANCE):
+    # Mede todos os PNGs da pasta e devolve uma lista de dicts ordenada do pior para o melhor:
+    # {'name', 'score', 'rejected', 'duplicate_of', + METRICS, 'dhash'}
+    paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.lower().endswith('.png')]
+
+    start = time.perf_counter()
+    if workers > 1 and paths:
+        if chunksize is None:
+            chunksize = max(1, len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(measure_sprite, paths, chunksize=chunksize))
+    else:
+        results = list(map(measure_sprite, paths))
+
+    names, metrics = [], []
+    for name, m in results:
+        if m is None:
+            print(f"Não foi possivel ler a imagem: {name}")
+            continue
+        names.append(name)
+        metrics.append(m)
+
+    _, representatives = unique_images(directory, names, duplicate_distance, workers)
+    scores, rejected, duplicate_of = score_sprites(names, metrics, representatives)
+    print(f"{len(names)} sprites medidos em {time.perf_counter() - start:.1f}s, "
+          f"{int(rejected.sum())} rejeitados automaticamente")
+
+    report = [dict(m, name=name, score=float(score), rejected=bool(reject), duplicate_of=duplicate)
+              for name, m, score, reject, duplicate in zip(names, metrics, scores, rejected, duplicate_of)]
+    report.sort(key=lambda r: (-r['score'], r['name']))
+    return report
+
+
+def review_worst_first(directory, workers=1, auto_reject=False, **review_options):
+    # Revisao manual (Limpeza_das_imagens.py) com os piores sprites primeiro.
+    # auto_reject=True manda direto para a lixeira da revisao os rejeitados obvios (e registra no log,
+    # entao o undo e a lixeira funcionam como numa exclusao manual) e so mostra o resto
+    from Limpeza_das_imagens import REVIEW_LOG_FILENAME, DecisionLog, PendingDeletes, browse_and_manage_images
+
+    report = triage_sprites(directory, workers)
+
+    if auto_reject:
+        log = DecisionLog(review_options.get('log_path', REVIEW_LOG_FILENAME))
+        deletes = PendingDeletes(directory)
+        for r in report:
+            if r['rejected'] and r['name'] not in log:
+                deletes.add(r['name'])
+                log.record(r['name'], 'deleted')
+        deletes.flush()
+        log.close()
+        report = [r for r in report if not r['rejected']]
+
+    browse_and_manage_images(directory, files=[r['name'] for r in report], **review_options)
+
+
+if __name__ == '__main__':
+    image_directory = '/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_PNG_Transparente'
+
+    # python TriagemSprites.py [pasta] -> só lista os 20 piores; python TriagemSprites.py [pasta] revisar -> abre a revisão
+    directory = sys.argv[1] if len(sys.argv) > 1 else image_directory
+    if len(sys.argv) > 2 and sys.argv[2] == 'revisar':
+        review_worst_first(directory, workers=os.cpu_count(), auto_reject=True)
+    else:
+        for r in triage_sprites(directory, workers=os.cpu_count())[:20]:
+            print(f"{r['score']:.2f} {r['name']}: opaco {r['opaque_ratio']:.3f}, borda branca {r['white_fringe']:.3f}, "
+                  f"{r['alpha_components']} pedaços, blur {r['blur']:.0f}"
+                  + (f", repetido de {r['duplicate_of']}" if r['duplicate_of'] != r['name'] else '')
+                  + (' [rejeitado]' if r['rejected'] else ''))
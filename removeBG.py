@@ -1,30 +1,241 @@
 import cv2
 import numpy as np
 import os
+import sys
+import json
+import hashlib
+import time
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
-def remove_background_and_save(input_dir, output_dir):
+# Guarda, na pasta de saida, os parametros da ultima execucao completa (modo skip_up_to_date='mtime': com outros
+# parametros tudo e reprocessado) e o hash (entrada + parametros) de cada imagem ja processada (modo 'hash')
+STATE_FILENAME = '.removebg_state.json'
+
+# Níveis de matting, do mais rápido ao de melhor qualidade:
+#   'hard'    -> alfa binário (0/255) pelo limiar de cinza, como sempre foi
+#   'feather' -> borda suavizada pela distância até a borda do alfa binário (distance transform)
+#   'guided'  -> 'feather' refinado por um guided filter guiado pela própria imagem (segue melhor as folhas)
+# Nos níveis suaves a transição fica só por dentro do alfa binário (fora dele o alfa continua 0, nenhum pixel
+# do fundo branco entra) e a cor dos pixels semitransparentes vem do pixel opaco mais próximo, senão a
+# árvore colada fica com um halo claro
+MATTING_TIERS = ('hard', 'feather', 'guided')
+
+def feather_alpha(alpha, radius):
+    # Distância (em pixels) de cada pixel do alfa binário até a borda dele. A transição de 0 a 1 acontece
+    # numa faixa de `radius` pixels por dentro da borda: o primeiro pixel tem alfa 1/radius, fora é 0
+    inside = cv2.distanceTransform(alpha, cv2.DIST_L2, cv2.DIST_MASK_5)
+    return np.clip(inside / radius, 0.0, 1.0)
+
+def guided_filter(guide, src, radius, eps):
+    # Guided filter (He et al.) com filtros de média (cv2.boxFilter): tudo vetorizado, em float32
+    size = (2 * radius + 1, 2 * radius + 1)
+    mean_guide = cv2.boxFilter(guide, -1, size)
+    mean_src = cv2.boxFilter(src, -1, size)
+    covariance = cv2.boxFilter(guide * src, -1, size) - mean_guide * mean_src
+    variance = cv2.boxFilter(guide * guide, -1, size) - mean_guide * mean_guide
+
+    a = covariance / (variance + eps)
+    b = mean_src - a * mean_guide
+    return cv2.boxFilter(a, -1, size) * guide + cv2.boxFilter(b, -1, size)
+
+def fill_edge_colors(img, core, edge, max_distance):
+    # Pixels da borda (edge) recebem a cor do pixel opaco (core) mais próximo, se ele estiver a até
+    # max_distance pixels; galhos finos, sem miolo opaco por perto, ficam com a própria cor.
+    # Os pixels da borda costumam ser misturas com o branco do fundo: com a cor original viram um contorno claro
+    if not core.any():
+        return img
+    distance, labels = cv2.distanceTransformWithLabels(np.where(core, 0, 255).astype(np.uint8), cv2.DIST_L2,
+                                                       cv2.DIST_MASK_5, labelType=cv2.DIST_LABEL_PIXEL)
+    # Com DIST_LABEL_PIXEL cada pixel do miolo tem o próprio rótulo (1, 2, ...) na ordem da varredura
+    ys, xs = np.nonzero(core)
+    nearest = img[ys[labels - 1], xs[labels - 1]]
+    use = edge & (distance <= max_distance)
+    return np.where(use[:, :, None], nearest, img)
+
+def remove_background(img, threshold=240, matting='hard', radius=3, eps=1e-3):
+    # Pixels quase brancos (cinza > threshold) viram transparentes
+    if matting not in MATTING_TIERS:
+        raise ValueError(f"matting inválido: {matting} (use um de {MATTING_TIERS})")
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, alpha = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV)
+
+    if matting == 'hard':
+        b, g, r = cv2.split(img)
+        return cv2.merge([b, g, r, alpha])
+
+    feathered = feather_alpha(alpha, radius)
+    soft_alpha = feathered
+    if matting == 'guided':
+        soft_alpha = np.clip(guided_filter(gray.astype(np.float32) / 255, feathered, radius, eps), 0.0, 1.0)
+        # O filtro espalha alfa para fora do binário: fora dele continua transparente
+        soft_alpha[alpha == 0] = 0.0
+
+    core = feathered >= 1.0
+    foreground = fill_edge_colors(img, core, (alpha > 0) & ~core, 2 * radius)
+    b, g, r = cv2.split(foreground)
+    return cv2.merge([b, g, r, np.round(soft_alpha * 255).astype(np.uint8)])
+
+def params_signature(threshold, png_compression, matting, radius):
+    # Parâmetros que mudam a saída (entram no hash do modo 'hash' e no estado do modo 'mtime')
+    return f"/{threshold}/{png_compression}/{matting}/{radius}"
+
+def save_state(state_path, state):
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+def process_image(job):
+    # Processa uma imagem (roda nos processos do pool). Devolve (nome, status, segundos, hash da entrada)
+    input_path, output_path, threshold, png_compression, previous_hash, matting, radius = job
+    filename = os.path.basename(input_path)
+    start = time.perf_counter()
+
+    # Lê os bytes uma vez só: servem para o hash e para decodificar
+    with open(input_path, 'rb') as f:
+        data = f.read()
+
+    input_hash = None
+    if previous_hash is not None:
+        params = params_signature(threshold, png_compression, matting, radius)
+        input_hash = hashlib.sha256(data + params.encode('utf-8')).hexdigest()
+        if input_hash == previous_hash and os.path.exists(output_path):
+            return filename, 'skipped', time.perf_counter() - start, input_hash
+
+    # Sempre 3 canais: PNGs que já têm alfa também funcionam
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return filename, 'failed', time.perf_counter() - start, None
+
+    final_image = remove_background(img, threshold, matting, radius)
+    if not cv2.imwrite(output_path, final_image, [cv2.IMWRITE_PNG_COMPRESSION, png_compression]):
+        return filename, 'failed', time.perf_counter() - start, None
+
+    return filename, 'processed', time.perf_counter() - start, input_hash
+
+def remove_background_and_save(input_dir, output_dir, workers=1, png_compression=3, skip_up_to_date='mtime',
+                               threshold=240, chunksize=None, matting='hard', radius=3):
+    # workers > 1 espalha as imagens num pool de processos.
+    # png_compression: 0 (mais rápido, arquivo maior) a 9 (mais lento, arquivo menor).
+    # skip_up_to_date: 'mtime' pula saídas mais novas que a entrada, se a última execução completa usou os
+    # mesmos parâmetros; 'hash' pula se o conteúdo da entrada e os parâmetros não mudaram (mais seguro, lê a
+    # entrada); None reprocessa tudo
+    # matting: 'hard', 'feather' ou 'guided' (ver MATTING_TIERS), escolhido para o lote inteiro;
+    # radius é a largura da borda suave em pixels
+    if skip_up_to_date not in ('mtime', 'hash', None):
+        raise ValueError(f"skip_up_to_date inválido: {skip_up_to_date}")
+    if matting not in MATTING_TIERS:
+        raise ValueError(f"matting inválido: {matting} (use um de {MATTING_TIERS})")
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    
-    for filename in os.listdir(input_dir):
+
+    # Estado: {'params': assinatura da última execução completa, 'hashes': {arquivo: hash}}
+    state_path = os.path.join(output_dir, STATE_FILENAME)
+    state = {'params': None, 'hashes': {}}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if 'hashes' not in state:
+            # Formato antigo: só os hashes do modo 'hash'
+            state = {'params': None, 'hashes': state}
+    hashes = state['hashes']
+    signature = params_signature(threshold, png_compression, matting, radius)
+    same_params = state['params'] == signature
+    if not same_params and skip_up_to_date is not None:
+        # As saídas vão ser sobrescritas com outros parâmetros: até esta execução terminar, nenhuma conta
+        # como em dia (se ela for interrompida, a próxima no modo 'mtime' reprocessa tudo)
+        state['params'] = None
+        save_state(state_path, state)
+
+    jobs = []
+    skipped = 0
+    for filename in sorted(os.listdir(input_dir)):
         if not filename.lower().endswith('.png'):
             continue
-            
+
         input_path = os.path.join(input_dir, filename)
         output_path = os.path.join(output_dir, filename)
-        
-        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, alpha = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
-        b, g, r = cv2.split(img)
+        if skip_up_to_date == 'mtime' and same_params and os.path.exists(output_path) \
+                and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+            skipped += 1
+            continue
+
+        # No modo 'hash' a comparação é feita no processo do pool (junto com a leitura do arquivo)
+        previous_hash = hashes.get(filename, '') if skip_up_to_date == 'hash' else None
+        jobs.append((input_path, output_path, threshold, png_compression, previous_hash, matting, radius))
+
+    if workers > 1 and jobs:
+        if chunksize is None:
+            chunksize = max(1, len(jobs) // (workers * 4))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(process_image, jobs, chunksize=chunksize)
+    else:
+        executor = None
+        results = map(process_image, jobs)
+
+    timings = []
+    failed = []
+    start = time.perf_counter()
+    try:
+        for filename, status, seconds, input_hash in results:
+            if status == 'processed':
+                timings.append((seconds, filename))
+                print(f"Processed: {filename} ({seconds * 1000:.1f} ms)")
+            elif status == 'skipped':
+                skipped += 1
+            else:
+                failed.append(filename)
+                print(f"Não foi possivel processar a imagem: {filename}")
+            if input_hash is not None:
+                hashes[filename] = input_hash
+        # Só uma execução que chegou ao fim marca os parâmetros como aplicados (interrompida, a próxima
+        # execução no modo 'mtime' reprocessa tudo de novo)
+        state['params'] = signature
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if skip_up_to_date is not None:
+            save_state(state_path, state)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(timings)} processadas, {skipped} já em dia, {len(failed)} com erro -- {elapsed:.1f}s")
+    if timings:
+        seconds = [t for t, _ in timings]
+        slowest = max(timings)
+        print(f"Tempo por imagem: média {np.mean(seconds) * 1000:.1f} ms, mediana {np.median(seconds) * 1000:.1f} ms, "
+              f"máximo {slowest[0] * 1000:.1f} ms ({slowest[1]})")
+    return len(timings), skipped, failed
+
+def check_edge_halo(matting='feather', radius=3, tolerance=2):
+    # Conferência dos níveis suaves: um disco verde-escuro com borda suavizada (anti-aliasing) sobre branco
+    # é recortado e colado sobre preto. Não pode sobrar alfa fora do disco nem contorno mais claro que o disco
+    color = np.array([0, 100, 0])
+    scale = 8
+    large = np.full((128 * scale, 128 * scale, 3), 255, dtype=np.uint8)
+    cv2.circle(large, (64 * scale, 64 * scale), 40 * scale, color.tolist(), -1)
+    img = cv2.resize(large, (128, 128), interpolation=cv2.INTER_AREA)
+
+    sprite = remove_background(img, matting=matting, radius=radius)
+    alpha = sprite[:, :, 3].astype(np.float32) / 255
+    composite = sprite[:, :, :3].astype(np.float32) * alpha[:, :, None]
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    assert not alpha[gray > 240].any(), "alfa fora do recorte binário"
+    brightest = composite.reshape(-1, 3).max(axis=0)
+    assert np.all(brightest <= color + tolerance), f"contorno claro: cor máxima {brightest} > {color}"
+    print(f"{matting}: sem halo (cor máxima colada sobre preto {brightest.astype(int)})")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        # Uso: python removeBG.py --check
+        for tier in ('feather', 'guided'):
+            check_edge_halo(tier)
+        sys.exit()
 
-        final_image = cv2.merge([b, g, r, alpha])
-        cv2.imwrite(output_path, final_image)
-        
- 
-# Exemplo de uso:
-input_directory =  "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/brancoTeste"
-output_directory = "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_teste"
+    # Exemplo de uso:
+    input_directory =  "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/brancoTeste"
+    output_directory = "/Users/iagocampista/Documents/Projects/Tree_Neural_Network/ImagensArvores/Individuais_teste"
 
-remove_background_and_save(input_directory, output_directory)
+    remove_background_and_save(input_directory, output_directory, workers=os.cpu_count())